@@ -0,0 +1,67 @@
+# database/migrations.py
+from sqlalchemy import text
+
+from logger_config import logger
+
+# create_all() crea las tablas nuevas pero nunca altera las existentes: las columnas añadidas
+# a tablas que ya estaban en producción se crean aquí. Todas las sentencias son idempotentes
+# y las NOT NULL llevan DEFAULT para que Postgres rellene las filas existentes.
+# Cada funcionalidad que añade columnas a una tabla existente trae aquí su propio bloque,
+# en el orden en que se añadieron.
+MIGRATIONS: list[tuple[str, list[str]]] = [
+    ("contenedores compartidos", [
+        "ALTER TABLE instances ALTER COLUMN api_key DROP NOT NULL",
+        "ALTER TABLE instances ADD COLUMN IF NOT EXISTS is_shared BOOLEAN NOT NULL DEFAULT false",
+        "ALTER TABLE instances ADD COLUMN IF NOT EXISTS container_name VARCHAR",
+        "ALTER TABLE instances ADD COLUMN IF NOT EXISTS session_name VARCHAR NOT NULL DEFAULT 'default'",
+        "CREATE INDEX IF NOT EXISTS ix_instances_container_name ON instances (container_name)",
+        # Las instancias anteriores corren en un contenedor dedicado con su mismo nombre
+        "UPDATE instances SET container_name = instance_name WHERE container_name IS NULL AND NOT is_shared",
+    ]),
+
+    ("varios nodos de Docker", [
+        "ALTER TABLE instances ADD COLUMN IF NOT EXISTS docker_host VARCHAR",
+        "CREATE INDEX IF NOT EXISTS ix_instances_docker_host ON instances (docker_host)",
+        "ALTER TABLE waha_containers ADD COLUMN IF NOT EXISTS docker_host VARCHAR",
+        "CREATE INDEX IF NOT EXISTS ix_waha_containers_docker_host ON waha_containers (docker_host)",
+    ]),
+
+    ("acuses de entrega y lectura", [
+        "ALTER TABLE message_links ADD COLUMN IF NOT EXISTS created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()",
+        "CREATE INDEX IF NOT EXISTS ix_message_links_created_at ON message_links (created_at)",
+        # 0 = sesión configurada antes de suscribirse a 'message.ack': session_sync la reconfigura
+        "ALTER TABLE instances ADD COLUMN IF NOT EXISTS webhook_config_version INTEGER NOT NULL DEFAULT 0",
+    ]),
+
+    ("webhook del tenant", [
+        "ALTER TABLE instances ADD COLUMN IF NOT EXISTS webhook_enabled BOOLEAN NOT NULL DEFAULT true",
+    ]),
+
+    ("archivo de mensajes", [
+        # En una tabla particionada, ADD COLUMN se propaga a todas las particiones
+        "ALTER TABLE message_archive ADD COLUMN IF NOT EXISTS source VARCHAR NOT NULL DEFAULT 'waha'",
+        "ALTER TABLE message_archive ADD COLUMN IF NOT EXISTS ghl_message_id VARCHAR",
+    ]),
+
+    ("hibernación de contenedores inactivos", [
+        "ALTER TABLE instances ADD COLUMN IF NOT EXISTS is_hibernated BOOLEAN NOT NULL DEFAULT false",
+        "ALTER TABLE instances ADD COLUMN IF NOT EXISTS last_activity_at TIMESTAMP WITH TIME ZONE",
+        "ALTER TABLE instances ADD COLUMN IF NOT EXISTS is_hibernating BOOLEAN NOT NULL DEFAULT false",
+        "ALTER TABLE instances ADD COLUMN IF NOT EXISTS is_waking BOOLEAN NOT NULL DEFAULT false",
+        "ALTER TABLE instances ADD COLUMN IF NOT EXISTS transition_started_at TIMESTAMP WITH TIME ZONE",
+    ]),
+]
+
+# Clave del bloqueo consultivo: con varios workers arrancando a la vez, migra uno y los demás esperan
+MIGRATION_LOCK_KEY = 726104
+
+def run_migrations(engine):
+    """Aplica MIGRATIONS en una sola transacción. Se llama al arrancar, después de create_all()."""
+    with engine.begin() as conn:
+        # El statement_timeout de la conexión (5 s) no basta para esperar el bloqueo ni para indexar tablas grandes
+        conn.execute(text("SET LOCAL statement_timeout = 0"))
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        for _, statements in MIGRATIONS:
+            for statement in statements:
+                conn.execute(text(statement))
+    logger.info(f"Migraciones del esquema aplicadas ({len(MIGRATIONS)} bloques).")
@@ -7,19 +7,52 @@ load_dotenv()
 
 from fastapi import FastAPI
 from database.connection import Base, engine
+from database.migrations import run_migrations
 
 # 👇 Importamos todos los routers en una sola línea
-from routers import auth, instance, webhook, ghl_oauth, ghl_actions
+from routers import auth, instance, webhook, ghl_oauth, ghl_actions, admin, usage as usage_router, archive
+from services.ack_coalescer import ack_coalescer
+from services.usage_meter import usage_meter
+from services.profiler import ProfilingMiddleware
+from services.invalidation_bus import invalidation_listener
+from services.webhook_fanout import webhook_fanout
+from services.message_archive import message_archiver
+from services.idle_manager import idle_manager
+from services import session_sync
 
 # Importamos los modelos para que SQLAlchemy cree las tablas
-from models import user, instance as instance_model
+from models import user, instance as instance_model, waha_container, message_link, usage, message_archive, docker_host_state
 Base.metadata.create_all(bind=engine)
+# create_all no altera tablas existentes: las columnas nuevas se añaden aquí
+run_migrations(engine)
 
 app = FastAPI(
     title="SaaS para Evolution API y GHL",
     version="0.1.0",
 )
 
+# Perfilado bajo demanda (desactivado por defecto; se controla desde /api/admin/profiling)
+app.add_middleware(ProfilingMiddleware)
+
+@app.on_event("startup")
+async def start_background_workers():
+    ack_coalescer.start()
+    usage_meter.start()
+    invalidation_listener.start()
+    message_archiver.start()
+    idle_manager.start()
+    # Las sesiones creadas antes de suscribirse a 'message.ack' (y otros cambios de configuración)
+    session_sync.start()
+
+@app.on_event("shutdown")
+async def stop_background_workers():
+    await ack_coalescer.stop()
+    await usage_meter.stop()
+    await invalidation_listener.stop()
+    await webhook_fanout.stop()
+    await message_archiver.stop()
+    await idle_manager.stop()
+
 @app.get("/")
 def read_root():
     return {"status": "ok", "message": "Servidor del SaaS funcionando correctamente."}
@@ -29,4 +62,7 @@ app.include_router(auth.router, prefix="/api")
 app.include_router(instance.router, prefix="/api")
 app.include_router(webhook.router, prefix="/api")
 app.include_router(ghl_oauth.router, prefix="/api")    
-app.include_router(ghl_actions.router, prefix="/api")
\ No newline at end of file
+app.include_router(ghl_actions.router, prefix="/api")
+app.include_router(admin.router, prefix="/api")
+app.include_router(usage_router.router, prefix="/api")
+app.include_router(archive.router, prefix="/api")
\ No newline at end of file
@@ -0,0 +1,14 @@
+# models/docker_host_state.py
+from sqlalchemy import Column, String, Boolean, DateTime, func
+from database.connection import Base
+
+class DockerHostState(Base):
+    """
+    Estado de un nodo de Docker compartido por todos los workers. Un nodo en 'draining'
+    no recibe contenedores nuevos hasta que un administrador lo reactiva.
+    """
+    __tablename__ = "docker_host_states"
+
+    name = Column(String, primary_key=True) # Nombre del nodo en DOCKER_HOSTS
+    draining = Column(Boolean, default=False, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
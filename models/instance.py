@@ -1,5 +1,5 @@
 # models/instance.py
-from sqlalchemy import Column, Integer, String, ForeignKey, LargeBinary, Boolean
+from sqlalchemy import Column, Integer, String, ForeignKey, LargeBinary, Boolean, DateTime
 from sqlalchemy.orm import relationship
 from database.connection import Base
 # La encriptación se manejará en el router para más claridad
@@ -10,7 +10,17 @@ class Instance(Base):
     id = Column(Integer, primary_key=True, index=True)
     instance_name = Column(String, unique=True, index=True, nullable=False)
     instance_url = Column(String, nullable=False)
-    api_key = Column(String, nullable=False) # API Key para la instancia de WAHA
+    # API Key del contenedor dedicado de WAHA. En modo compartido es None: la clave es del
+    # contenedor (WahaContainer) y da acceso a todas sus sesiones, así que nunca sale del servidor.
+    api_key = Column(String, nullable=True)
+    is_shared = Column(Boolean, default=False, nullable=False)
+
+    # Contenedor de WAHA que aloja la instancia y sesión dentro de él.
+    # En modo dedicado el contenedor es propio y la sesión es siempre 'default';
+    # en modo compartido el contenedor es un WahaContainer y la sesión se llama como la instancia.
+    container_name = Column(String, nullable=True, index=True)
+    session_name = Column(String, nullable=False, default="default")
+    docker_host = Column(String, nullable=True, index=True) # Nodo de Docker donde corre el contenedor
     
     # --- NUEVOS CAMPOS PARA OAUTH ---
     # Guardaremos los tokens de GHL aquí
@@ -20,7 +30,18 @@ class Instance(Base):
     ghl_user_id = Column(String)# <--- AÑADE ESTA LÍNEA
 
     webhook_url = Column(String, nullable=True) # Webhook para n8n, etc.
+    webhook_enabled = Column(Boolean, default=True, nullable=False) # Se desactiva solo si sigue fallando
+    # Versión de la configuración de webhook aplicada a la sesión de WAHA (ver WEBHOOK_CONFIG_VERSION)
+    webhook_config_version = Column(Integer, default=0, nullable=False)
     is_connected = Column(Boolean, default=False)
 
+    # Hibernación: el contenedor dedicado se detiene si no hay tráfico y se despierta al enviar
+    is_hibernated = Column(Boolean, default=False, nullable=False)
+    last_activity_at = Column(DateTime(timezone=True), nullable=True)
+    # Un worker se reserva la instancia mientras detiene o arranca el contenedor (sin bloquear la fila)
+    is_hibernating = Column(Boolean, default=False, nullable=False)
+    is_waking = Column(Boolean, default=False, nullable=False)
+    transition_started_at = Column(DateTime(timezone=True), nullable=True)
+
     owner_id = Column(Integer, ForeignKey("users.id"))
     owner = relationship("User", back_populates="instances")
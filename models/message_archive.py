@@ -0,0 +1,36 @@
+# models/message_archive.py
+from sqlalchemy import Column, Integer, BigInteger, String, Text, DateTime, Index
+from database.connection import Base
+
+class MessageArchive(Base):
+    """
+    Archivo compacto de los mensajes procesados, particionado por mes (RANGE sobre created_at).
+    Las particiones las crea y caduca services/message_archive.py. El cuerpo del mensaje
+    solo se guarda en los fallidos, para poder reenviarlos.
+    """
+    __tablename__ = "message_archive"
+    __table_args__ = (
+        Index("ix_message_archive_instance_time", "instance_id", "created_at"),
+        Index("ix_message_archive_instance_phone_time", "instance_id", "phone", "created_at"),
+        Index("ix_message_archive_instance_contact_time", "instance_id", "ghl_contact_id", "created_at"),
+        Index("ix_message_archive_instance_status_time", "instance_id", "status", "created_at"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
+    # En una tabla particionada la clave primaria debe incluir la columna de partición
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    created_at = Column(DateTime(timezone=True), primary_key=True)
+
+    instance_id = Column(Integer, nullable=False)
+    phone = Column(String, nullable=False)
+    direction = Column(String, nullable=False) # "inbound" | "outbound"
+    # "waha": mensaje recibido por el webhook de WAHA y reflejado en GHL;
+    # "ghl": envío de un agente desde GHL hacia WhatsApp
+    source = Column(String, nullable=False, default="waha", server_default="waha")
+    wa_message_id = Column(String, nullable=True)
+    ghl_contact_id = Column(String, nullable=True)
+    ghl_conversation_id = Column(String, nullable=True)
+    ghl_message_id = Column(String, nullable=True) # Solo en envíos desde GHL, para relacionar sus acuses al reenviar
+    status = Column(String, nullable=False) # "success" | "failed" | "redriven"
+    latency_ms = Column(Integer, nullable=True)
+    body = Column(Text, nullable=True)
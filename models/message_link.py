@@ -0,0 +1,17 @@
+# models/message_link.py
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, func
+from database.connection import Base
+
+class MessageLink(Base):
+    """
+    Relaciona un mensaje saliente de WhatsApp (ID de WAHA) con el mensaje creado en GHL,
+    para poder reflejar en GHL los acuses de entrega y lectura.
+    """
+    __tablename__ = "message_links"
+
+    id = Column(Integer, primary_key=True, index=True)
+    instance_id = Column(Integer, ForeignKey("instances.id", ondelete="CASCADE"), nullable=False, index=True)
+    wa_message_id = Column(String, unique=True, index=True, nullable=False)
+    ghl_message_id = Column(String, nullable=False)
+    last_ack = Column(Integer, nullable=True) # Último acuse ya enviado a GHL
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False, index=True)
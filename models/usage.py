@@ -0,0 +1,21 @@
+# models/usage.py
+from sqlalchemy import Column, Integer, Date, ForeignKey, UniqueConstraint
+from database.connection import Base
+
+class UsageCounter(Base):
+    """
+    Uso diario de cada instancia, para facturación y cuotas.
+    Se escribe por lotes desde services/usage_meter.py, nunca por mensaje.
+    """
+    __tablename__ = "usage_counters"
+    __table_args__ = (UniqueConstraint("instance_id", "day", name="uq_usage_instance_day"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    instance_id = Column(Integer, ForeignKey("instances.id", ondelete="CASCADE"), nullable=False, index=True)
+    day = Column(Date, nullable=False) # Día en UTC
+
+    inbound_messages = Column(Integer, nullable=False, default=0)
+    outbound_messages = Column(Integer, nullable=False, default=0)
+    media_messages = Column(Integer, nullable=False, default=0)
+    ghl_calls = Column(Integer, nullable=False, default=0)
+    waha_calls = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,18 @@
+# models/waha_container.py
+from sqlalchemy import Column, Integer, String
+from database.connection import Base
+
+class WahaContainer(Base):
+    """
+    Contenedor de WAHA multi-sesión compartido por varios tenants (modo compartido).
+    Cada Instance alojada aquí apunta a él por 'container_name' y usa su propia sesión.
+    """
+    __tablename__ = "waha_containers"
+
+    id = Column(Integer, primary_key=True, index=True)
+    container_name = Column(String, unique=True, index=True, nullable=False)
+    instance_url = Column(String, nullable=False) # URL pública (la que se guarda en cada Instance)
+    internal_url = Column(String, nullable=False) # URL accesible desde el backend (host.docker.internal)
+    api_key = Column(String, nullable=False)
+    max_sessions = Column(Integer, nullable=False)
+    docker_host = Column(String, nullable=True, index=True) # Nodo de Docker donde corre el contenedor
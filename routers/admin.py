@@ -0,0 +1,82 @@
+# routers/admin.py
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import FileResponse
+from sqlalchemy.orm import Session
+
+from database.connection import get_db
+from models.user import User
+from routers.auth import get_current_admin_user
+from services.docker_scheduler import scheduler
+from services.host_drain import start_drain, drain_jobs, set_draining
+from services.admission import admission, work_lanes
+from services.profiler import profiling_settings, profile_store, publish_settings
+from schemas.profiling import ProfilingSettings
+
+router = APIRouter(prefix="/admin", tags=["Admin"])
+
+@router.get("/docker-hosts")
+def list_docker_hosts(current_user: User = Depends(get_current_admin_user)):
+    """Capacidad libre estimada de cada nodo de Docker."""
+    return {"strategy": scheduler.strategy, "hosts": scheduler.capacities()}
+
+@router.post("/docker-hosts/{host_name}/drain", status_code=202)
+def drain_docker_host(host_name: str, current_user: User = Depends(get_current_admin_user)):
+    """
+    Deja de asignar contenedores al nodo y migra en segundo plano los que tiene a otros nodos.
+    El progreso se consulta en GET /admin/docker-hosts/{host_name}/drain.
+    """
+    if host_name not in scheduler.hosts:
+        raise HTTPException(status_code=404, detail=f"Nodo de Docker desconocido: '{host_name}'")
+    job = start_drain(host_name)
+    if job is None:
+        raise HTTPException(status_code=409, detail=f"Ya hay un vaciado en curso para '{host_name}'.")
+    return job
+
+@router.get("/docker-hosts/{host_name}/drain")
+def get_drain_status(host_name: str, current_user: User = Depends(get_current_admin_user)):
+    """Estado del último vaciado del nodo lanzado desde este proceso."""
+    job = drain_jobs.get(host_name)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No hay vaciados registrados para '{host_name}'.")
+    return job
+
+@router.delete("/docker-hosts/{host_name}/drain")
+def undrain_docker_host(host_name: str, current_user: User = Depends(get_current_admin_user)):
+    """Vuelve a admitir contenedores nuevos en el nodo."""
+    if host_name not in scheduler.hosts:
+        raise HTTPException(status_code=404, detail=f"Nodo de Docker desconocido: '{host_name}'")
+    job = drain_jobs.get(host_name)
+    if job and job["status"] == "running":
+        raise HTTPException(status_code=409, detail=f"Hay un vaciado en curso para '{host_name}'.")
+    set_draining(host_name, False)
+    return {"host": host_name, "draining": False}
+
+@router.get("/admission")
+def admission_stats(current_user: User = Depends(get_current_admin_user)):
+    """Peticiones en curso y rechazadas por el control de admisión de este proceso."""
+    return {**admission.stats(), "work_slots_in_use": work_lanes.in_use, "work_slots": work_lanes.slots}
+
+@router.get("/profiling", response_model=ProfilingSettings)
+def get_profiling(current_user: User = Depends(get_current_admin_user)):
+    """Configuración actual del perfilado de peticiones en este proceso."""
+    return profiling_settings.as_dict()
+
+@router.put("/profiling", response_model=ProfilingSettings)
+def set_profiling(settings: ProfilingSettings, db: Session = Depends(get_db), current_user: User = Depends(get_current_admin_user)):
+    """Activa o desactiva el perfilado por ruta, por tenant o por muestreo en todos los workers, sin redesplegar."""
+    publish_settings(db, settings.model_dump())
+    db.commit()
+    return profiling_settings.as_dict()
+
+@router.get("/profiling/profiles")
+def list_profiles(current_user: User = Depends(get_current_admin_user)):
+    """Perfiles guardados, del más reciente al más antiguo."""
+    return profile_store.list()
+
+@router.get("/profiling/profiles/{name}")
+def download_profile(name: str, current_user: User = Depends(get_current_admin_user)):
+    """Descarga un perfil en formato 'collapsed' (flamegraph.pl, speedscope)."""
+    path = profile_store.path_for(name)
+    if not path:
+        raise HTTPException(status_code=404, detail="Perfil no encontrado.")
+    return FileResponse(path, media_type="text/plain", filename=name)
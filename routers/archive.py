@@ -0,0 +1,155 @@
+# routers/archive.py
+import base64
+from datetime import datetime
+from typing import Optional, Literal
+from fastapi import APIRouter, Depends, HTTPException, Query, BackgroundTasks
+from pydantic import BaseModel, Field
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Session
+
+from logger_config import logger
+from database.connection import get_db
+from models.user import User
+from models.instance import Instance as InstanceModel
+from models.message_archive import MessageArchive
+from routers.auth import get_current_active_user
+from routers.webhook import process_message
+from routers.ghl_actions import send_to_whatsapp
+from services.instance_cache import get_instance_by_name
+
+router = APIRouter(prefix="/archive", tags=["Message Archive"])
+
+class RedriveRequest(BaseModel):
+    since: datetime
+    until: Optional[datetime] = None
+    limit: int = Field(500, ge=1, le=5000)
+
+def _get_user_instance(db: Session, user: User) -> InstanceModel:
+    instance = db.query(InstanceModel).filter(InstanceModel.owner_id == user.id).first()
+    if not instance:
+        raise HTTPException(status_code=404, detail="No se encontró una instancia para este usuario.")
+    return instance
+
+def _encode_cursor(row: MessageArchive) -> str:
+    return base64.urlsafe_b64encode(f"{row.created_at.isoformat()}|{row.id}".encode()).decode()
+
+def _decode_cursor(cursor: str):
+    try:
+        created_at, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(row_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor inválido.")
+
+def _serialize(row: MessageArchive) -> dict:
+    return {
+        "id": row.id,
+        "created_at": row.created_at.isoformat(),
+        "phone": row.phone,
+        "direction": row.direction,
+        "source": row.source,
+        "status": row.status,
+        "latency_ms": row.latency_ms,
+        "wa_message_id": row.wa_message_id,
+        "ghl_contact_id": row.ghl_contact_id,
+        "ghl_conversation_id": row.ghl_conversation_id,
+    }
+
+@router.get("/messages")
+def list_archived_messages(
+    phone: Optional[str] = None,
+    contact_id: Optional[str] = None,
+    status: Optional[Literal["success", "failed", "redriven"]] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Mensajes archivados de la instancia del usuario, del más reciente al más antiguo.
+    Paginación por cursor (keyset): pase 'next_cursor' de la respuesta para la página siguiente.
+    Acotar 'since'/'until' permite a Postgres descartar particiones enteras.
+    """
+    instance = _get_user_instance(db, current_user)
+    query = db.query(MessageArchive).filter(MessageArchive.instance_id == instance.id)
+    if phone:
+        query = query.filter(MessageArchive.phone == phone)
+    if contact_id:
+        query = query.filter(MessageArchive.ghl_contact_id == contact_id)
+    if status:
+        query = query.filter(MessageArchive.status == status)
+    if since:
+        query = query.filter(MessageArchive.created_at >= since)
+    if until:
+        query = query.filter(MessageArchive.created_at < until)
+    if cursor:
+        query = query.filter(tuple_(MessageArchive.created_at, MessageArchive.id) < tuple_(*_decode_cursor(cursor)))
+
+    rows = query.order_by(MessageArchive.created_at.desc(), MessageArchive.id.desc()).limit(limit + 1).all()
+    page = rows[:limit]
+    return {
+        "messages": [_serialize(row) for row in page],
+        "next_cursor": _encode_cursor(page[-1]) if len(rows) > limit else None,
+    }
+
+async def _redrive(instance_name: str, jobs: list[tuple[str, object]], db: Session):
+    # En serie y en orden, para no competir con el tráfico en vivo
+    for source, job in jobs:
+        if source == "ghl":
+            # Envío de un agente: se vuelve a mandar por WhatsApp, no se refleja otra vez en GHL
+            instance = get_instance_by_name(db, instance_name)
+            if instance is None:
+                logger.error(f"Reenvío masivo interrumpido: la instancia '{instance_name}' ya no existe.")
+                return
+            phone, body, ghl_message_id = job
+            await send_to_whatsapp(db, instance, phone, body, ghl_message_id)
+        else:
+            await process_message(instance_name, job, db)
+    logger.info(f"Reenvío masivo para '{instance_name}' terminado: {len(jobs)} mensajes.")
+
+@router.post("/redrive")
+def redrive_failed_messages(
+    request: RedriveRequest,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Reintenta los mensajes fallidos del intervalo indicado por el camino por el que llegaron:
+    los del webhook de WAHA vuelven a pasar por el espejo a GHL y los envíos desde GHL
+    se vuelven a mandar por WhatsApp. Las filas originales quedan como 'redriven'
+    y el reintento genera filas nuevas.
+    """
+    instance = _get_user_instance(db, current_user)
+    query = db.query(MessageArchive).filter(
+        MessageArchive.instance_id == instance.id,
+        MessageArchive.status == "failed",
+        MessageArchive.body.isnot(None),
+        MessageArchive.created_at >= request.since,
+    )
+    if request.until:
+        query = query.filter(MessageArchive.created_at < request.until)
+    rows = query.order_by(MessageArchive.created_at).limit(request.limit).all()
+
+    jobs = []
+    for row in rows:
+        row.status = "redriven"
+        if row.source == "ghl":
+            jobs.append(("ghl", (row.phone, row.body, row.ghl_message_id)))
+            continue
+        chat_id = f"{row.phone}@c.us"
+        is_from_me = row.direction == "outbound"
+        # Reconstruimos un payload con la forma del webhook de WAHA
+        jobs.append(("waha", {"payload": {
+            "id": row.wa_message_id,
+            "fromMe": is_from_me,
+            "from": chat_id if not is_from_me else "",
+            "to": chat_id if is_from_me else "",
+            "body": row.body,
+        }}))
+    db.commit()
+
+    background_tasks.add_task(_redrive, instance.instance_name, jobs, db)
+    logger.info(f"Reenvío masivo encolado para '{instance.instance_name}': {len(jobs)} mensajes.")
+    return {"status": "redrive_queued", "count": len(jobs)}
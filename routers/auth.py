@@ -20,6 +20,8 @@ from schemas.token import Token
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
+# Correos (separados por comas) de los usuarios con acceso a los endpoints de administración
+ADMIN_EMAILS = {email.strip().lower() for email in os.getenv("ADMIN_EMAILS", "").split(",") if email.strip()}
 
 # Validar que las claves secretas existan
 if not SECRET_KEY:
@@ -95,6 +97,12 @@ async def get_current_active_user(current_user: User = Depends(get_current_user)
         raise HTTPException(status_code=400, detail="Usuario inactivo")
     return current_user
 
+async def get_current_admin_user(current_user: User = Depends(get_current_active_user)):
+    """Verifica si el usuario actual es administrador (ADMIN_EMAILS)."""
+    if current_user.email.lower() not in ADMIN_EMAILS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Se requieren permisos de administrador")
+    return current_user
+
 # --- Endpoints de Autenticación ---
 
 @router.post("/register", response_model=UserSchema, status_code=status.HTTP_201_CREATED)
@@ -2,11 +2,17 @@
 from fastapi import APIRouter, Request, Depends
 from sqlalchemy.orm import Session
 import json
+import time
 
 from logger_config import logger
-from database.connection import get_db
-from models.instance import Instance as InstanceModel
+from database.connection import get_db, SessionLocal
 from services import waha_service
+from services.ack_coalescer import link_message
+from services.usage_meter import usage_meter
+from services.message_archive import message_archiver
+from services.instance_cache import get_instance_by_location
+from services.idle_manager import idle_manager
+from services.admission import admission, work_lanes
 
 router = APIRouter(prefix="/ghl-actions", tags=["GHL Actions"])
 
@@ -16,9 +22,20 @@ async def handle_send_request(request: Request, db: Session = Depends(get_db)):
     Este endpoint es llamado por GHL cuando un usuario quiere enviar un mensaje.
     """
     payload = await request.json()
+
+    # Control de admisión: si estamos sobrecargados respondemos 503 y GHL reintenta más tarde.
+    ticket = admission.admit("ghl_send", str(payload.get("locationId")))
+
     logger.info("==================== GHL -> SEND-MESSAGE ====================")
     logger.info(f"Petición de envío recibida desde GHL: {json.dumps(payload, indent=2)}")
+    try:
+        # Carril de alta prioridad: los envíos de agentes no esperan detrás del espejo entrante.
+        async with work_lanes.slot(high_priority=True):
+            return await _send_message(payload, db)
+    finally:
+        ticket.release()
 
+async def _send_message(payload: dict, db: Session):
     try:
         # Extraemos los datos que GHL nos envía
         location_id = payload.get("locationId")
@@ -31,24 +48,69 @@ async def handle_send_request(request: Request, db: Session = Depends(get_db)):
             return {"status": "error", "message": "Payload incompleto"}
 
         # Buscamos la instancia de WAHA que corresponde a esta location de GHL
-        instance = db.query(InstanceModel).filter(InstanceModel.ghl_location_id == location_id).first()
+        instance = get_instance_by_location(db, location_id)
         if not instance:
             logger.error(f"No se encontró una instancia de WAHA para la locationId: {location_id}")
             return {"status": "error", "message": "Instancia no configurada"}
+
+        if usage_meter.over_quota(instance.id):
+            logger.warning(f"La instancia '{instance.instance_name}' ha superado su cuota diaria de mensajes.")
+            return {"status": "error", "message": "Cuota diaria de mensajes superada"}
             
-        # Usamos nuestro nuevo servicio para enviar el mensaje por WhatsApp
-        success = await waha_service.send_whatsapp_message(
-            instance_url=instance.instance_url,
-            api_key=instance.api_key,
-            to_number=phone_number,
-            message=message
-        )
-
-        if success:
-            return {"status": "success"}
-        else:
-            return {"status": "error", "message": "Fallo al enviar el mensaje por WAHA"}
+        idle_manager.touch(instance.instance_name)
+        ghl_message_id = payload.get("messageId")
+
+        return await send_to_whatsapp(db, instance, phone_number, message, ghl_message_id)
 
     except Exception as e:
         logger.error(f"Excepción al procesar el webhook de envío de GHL: {e}", exc_info=True)
-        return {"status": "error", "message": "Error interno del servidor"}
\ No newline at end of file
+        return {"status": "error", "message": "Error interno del servidor"}
+
+async def send_to_whatsapp(db: Session, instance, phone_number: str, message: str, ghl_message_id: str | None) -> dict:
+    """
+    Envía por WhatsApp un mensaje de GHL, o lo encola si la instancia está hibernada.
+    Lo usan el webhook de envío de GHL y el reenvío de fallidos del archivo.
+    """
+    if instance.is_hibernated or instance.is_hibernating:
+        # El contenedor está dormido (o deteniéndose): se despierta y el mensaje sale en cuanto esté listo
+        async def send_when_awake(awake_instance):
+            queued_db = SessionLocal()
+            try:
+                await _deliver(queued_db, awake_instance, phone_number, message, ghl_message_id)
+            finally:
+                queued_db.close()
+
+        if not idle_manager.queue_send(instance, send_when_awake, phone_number, message, ghl_message_id):
+            return {"status": "error", "message": "Demasiados mensajes en espera para la instancia"}
+        logger.info(f"Instancia '{instance.instance_name}' hibernada: mensaje encolado hasta que despierte.")
+        return {"status": "queued"}
+
+    sent_message = await _deliver(db, instance, phone_number, message, ghl_message_id)
+    if sent_message is not None:
+        return {"status": "success"}
+    else:
+        return {"status": "error", "message": "Fallo al enviar el mensaje por WAHA"}
+
+async def _deliver(db: Session, instance, phone_number: str, message: str, ghl_message_id: str | None):
+    """Envía el mensaje por WAHA, lo archiva y lo relaciona con el de GHL para reflejar sus acuses."""
+    started_at = time.monotonic()
+    # Usamos nuestro nuevo servicio para enviar el mensaje por WhatsApp
+    usage_meter.increment(instance.id, "waha_calls")
+    sent_message = await waha_service.send_whatsapp_message(
+        instance_url=instance.instance_url,
+        api_key=instance.waha_api_key,
+        to_number=phone_number,
+        message=message,
+        session=instance.session_name or "default"
+    )
+    wa_message_id = waha_service.extract_message_id(sent_message) if sent_message is not None else None
+    message_archiver.record(
+        instance.id, phone_number, "outbound", "success" if sent_message is not None else "failed",
+        latency_ms=int((time.monotonic() - started_at) * 1000), wa_message_id=wa_message_id, body=message,
+        source="ghl", ghl_message_id=ghl_message_id
+    )
+    if sent_message is not None:
+        # Los envíos por API no vuelven como eco 'fromMe' (la sesión solo escucha 'message'): se cuentan aquí
+        usage_meter.increment(instance.id, "outbound_messages")
+        link_message(db, instance.id, wa_message_id, ghl_message_id)
+    return sent_message
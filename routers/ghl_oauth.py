@@ -12,6 +12,7 @@ from models.instance import Instance as InstanceModel
 from models.user import User
 from routers.auth import get_current_active_user
 from logger_config import logger
+from services.instance_cache import invalidate_instance
 
 router = APIRouter(prefix="/marketplace", tags=["Marketplace OAuth"])
 
@@ -91,12 +92,15 @@ async def ghl_oauth_callback(code: str, state: str, request: Request, db: Sessio
             logger.info("==========================================================")
             
             # Guardamos todos los datos necesarios
+            old_location_id = instance.ghl_location_id
             instance.ghl_access_token = token_json.get("access_token")
             instance.ghl_refresh_token = token_json.get("refresh_token")
             instance.ghl_location_id = token_json.get("locationId")
             instance.ghl_user_id = token_json.get("userId")
             instance.is_connected = True
-            
+
+            # Los demás workers descartan su copia cacheada al confirmarse la transacción
+            invalidate_instance(db, instance, old_location_id)
             db.commit()
             db.refresh(instance)
             
@@ -1,11 +1,7 @@
 # routers/instance.py
-import docker
 import secrets
-import socket
-import time
-import requests
-import os
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import Response
 from sqlalchemy.orm import Session
 from pydantic import BaseModel, HttpUrl, Field
 
@@ -13,67 +9,17 @@ from logger_config import logger
 from database.connection import get_db
 from models.user import User
 from models.instance import Instance as InstanceModel
-from schemas.instance import Instance as InstanceSchema
+from models.waha_container import WahaContainer
+from schemas.instance import Instance as InstanceSchema, InstanceWebhookUpdate
 from routers.auth import get_current_active_user
+from services.docker_service import start_waha_container, wait_for_instance_ready, configure_waha_session, discard_container, webhook_url_for, WEBHOOK_CONFIG_VERSION
+from services.docker_scheduler import scheduler, NoCapacityError
+from services import waha_pool, waha_service
+from services.instance_cache import invalidate_instance
+from services.webhook_fanout import check_public_url
 
 router = APIRouter(prefix="/instances", tags=["Instances"])
 
-DOCKER_NETWORK_NAME = os.getenv("DOCKER_NETWORK", "my_saas_network")
-
-def find_free_port():
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.bind(('', 0))
-        return s.getsockname()[1]
-
-def wait_for_instance_ready(instance_url: str, api_key: str, timeout: int = 60):
-    start_time = time.time()
-    health_check_url = f"{instance_url}/api/server/status"
-    logger.info(f"Verificando la instancia en: {health_check_url}")
-    
-    while time.time() - start_time < timeout:
-        try:
-            response = requests.get(health_check_url, headers={"X-Api-Key": api_key}, timeout=5)
-            if response.status_code == 200:
-                logger.info(f"¡ÉXITO! La instancia en {instance_url} está lista.")
-                return True
-        except requests.exceptions.RequestException:
-            logger.info(f"Esperando a la instancia en {instance_url}...")
-        
-        time.sleep(2)
-        
-    raise TimeoutError(f"La nueva instancia de API no respondió a tiempo en {instance_url}")
-
-def configure_waha_session(instance_url: str, api_key: str, webhook_target_url: str):
-    """
-    Configura la sesión 'default' de WAHA para que use nuestro webhook.
-    """
-    endpoint = f"{instance_url}/api/sessions/default"
-    headers = {"X-Api-Key": api_key, "Content-Type": "application/json"}
-    payload = {
-      "config": {
-        "webhooks": [
-          {
-            "url": webhook_target_url,
-            "events": [
-              "message",
-              "session.status"
-            ]
-          }
-        ]
-      }
-    }
-    
-    logger.info(f"Configurando sesión 'default' para la instancia en {instance_url}...")
-    logger.info(f"URL del Webhook a configurar: {webhook_target_url}")
-
-    try:
-        response = requests.put(endpoint, headers=headers, json=payload, timeout=10)
-        response.raise_for_status()
-        logger.info(f"Sesión 'default' configurada exitosamente. Respuesta: {response.json()}")
-    except requests.exceptions.RequestException as e:
-        logger.error(f"FALLO CRÍTICO al configurar la sesión de la instancia: {e}")
-        raise
-
 @router.post("/", response_model=InstanceSchema, status_code=status.HTTP_201_CREATED)
 def create_instance(db: Session = Depends(get_db), current_user: User = Depends(get_current_active_user)):
     logger.info("Iniciando el proceso de creación de instancia...")
@@ -82,57 +28,168 @@ def create_instance(db: Session = Depends(get_db), current_user: User = Depends(
     if existing_instance:
         raise HTTPException(status_code=400, detail="El usuario ya tiene una instancia activa.")
 
+    if waha_pool.SHARED_MODE:
+        return create_shared_instance(db, current_user)
+
     container = None
     try:
-        instance_port = find_free_port()
         instance_name = f"wa_instance_{current_user.id}_{secrets.token_hex(4)}"
         instance_api_key = secrets.token_hex(16)
         
-        client = docker.from_env()
+        host = scheduler.place()
 
-        public_url = f"http://localhost:{instance_port}"
-        
-        container = client.containers.run(
-            "devlikeapro/whatsapp-http-api:latest",
-            detach=True,
-            name=instance_name,
-            ports={f"3000/tcp": instance_port},
-            environment={"WAHA_API_KEY": instance_api_key},
-            network=DOCKER_NETWORK_NAME,
-            extra_hosts={"host.docker.internal": "host-gateway"}
-        )
-        logger.info(f"Contenedor '{container.name}' iniciado exitosamente.")
+        container, instance_port = start_waha_container(host.client, instance_name, instance_api_key)
+        public_url = host.public_url(instance_port)
 
-        instance_url_for_api = f"http://host.docker.internal:{instance_port}"
+        instance_url_for_api = host.internal_url(instance_port)
         
         wait_for_instance_ready(instance_url_for_api, instance_api_key)
         
         # --- CORRECCIÓN FINAL Y DEFINITIVA ---
-        # Usamos 'host.docker.internal' que es una URL válida para el validador de WAHA
+        # Por defecto usamos 'host.docker.internal', que es una URL válida para el validador de WAHA
         # y apunta correctamente a nuestro backend desde dentro de la red de Docker.
-        webhook_target_url = f"http://host.docker.internal:8000/api/webhooks/waha/{instance_name}"
+        webhook_target_url = webhook_url_for(instance_name)
         configure_waha_session(instance_url_for_api, instance_api_key, webhook_target_url)
 
         new_instance = InstanceModel(
             instance_name=instance_name,
             instance_url=public_url,
             api_key=instance_api_key,
+            container_name=instance_name,
+            session_name="default",
+            docker_host=host.name,
+            webhook_config_version=WEBHOOK_CONFIG_VERSION,
             owner_id=current_user.id
         )
         db.add(new_instance)
+        invalidate_instance(db, new_instance)
         db.commit()
         db.refresh(new_instance)
         logger.info(f"Instancia '{instance_name}' guardada en la base de datos principal.")
 
         return new_instance
 
+    except NoCapacityError as e:
+        logger.error(f"No se pudo crear la instancia: {e}")
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         if container:
-            try: 
-                logs = container.logs().decode('utf-8')
-                logger.error(f"Logs del contenedor fallido '{container.name}':\n{logs}")
-                container.stop(); container.remove()
-            except: pass
+            discard_container(container)
         
         logger.error(f"Error catastrófico durante la creación: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error inesperado: {str(e)}")
+
+def create_shared_instance(db: Session, current_user: User):
+    """
+    Modo compartido: en lugar de arrancar un contenedor propio, crea una sesión con
+    nombre propio dentro de un contenedor multi-sesión del pool.
+    """
+    try:
+        instance_name = f"wa_instance_{current_user.id}_{secrets.token_hex(4)}"
+        pool_container = waha_pool.acquire_shared_container(db)
+        internal_url, pool_api_key = pool_container.internal_url, pool_container.api_key
+
+        # La instancia se guarda antes de crear la sesión: ocupa su hueco en el contenedor
+        # y el commit libera enseguida el bloqueo de la fila del contenedor.
+        new_instance = InstanceModel(
+            instance_name=instance_name,
+            instance_url=pool_container.instance_url,
+            api_key=None,
+            is_shared=True,
+            container_name=pool_container.container_name,
+            session_name=instance_name,
+            docker_host=pool_container.docker_host,
+            webhook_config_version=WEBHOOK_CONFIG_VERSION,
+            owner_id=current_user.id
+        )
+        db.add(new_instance)
+        db.commit()
+        db.refresh(new_instance)
+
+        # La sesión se llama igual que la instancia, así el webhook sigue enrutándose por nombre.
+        try:
+            configure_waha_session(internal_url, pool_api_key, webhook_url_for(instance_name), session_name=instance_name, create=True)
+        except Exception:
+            db.delete(new_instance)
+            db.commit()
+            raise
+
+        invalidate_instance(db, new_instance)
+        db.commit()
+        db.refresh(new_instance)
+        logger.info(f"Instancia '{instance_name}' creada como sesión del contenedor compartido '{new_instance.container_name}'.")
+
+        return new_instance
+
+    except NoCapacityError as e:
+        logger.error(f"No se pudo crear la instancia: {e}")
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error catastrófico durante la creación (modo compartido): {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error inesperado: {str(e)}")
+
+@router.put("/me/webhook", response_model=InstanceSchema)
+def update_instance_webhook(webhook: InstanceWebhookUpdate, db: Session = Depends(get_db), current_user: User = Depends(get_current_active_user)):
+    """
+    Configura el webhook al que se reenvían los mensajes procesados. Guardarlo
+    de nuevo reactiva un webhook desactivado por fallos repetidos.
+    """
+    instance = db.query(InstanceModel).filter(InstanceModel.owner_id == current_user.id).first()
+    if not instance:
+        raise HTTPException(status_code=404, detail="No se encontró una instancia para este usuario.")
+
+    if webhook.webhook_url:
+        try:
+            check_public_url(str(webhook.webhook_url))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    instance.webhook_url = str(webhook.webhook_url) if webhook.webhook_url else None
+    instance.webhook_enabled = True
+    invalidate_instance(db, instance)
+    db.commit()
+    db.refresh(instance)
+    logger.info(f"Webhook de la instancia '{instance.instance_name}' actualizado: {instance.webhook_url}")
+    return instance
+
+def _waha_access(db: Session, instance: InstanceModel) -> tuple[str, str]:
+    """
+    URL y clave con las que el servidor habla con la sesión de la instancia.
+    En modo compartido son las del contenedor del pool y nunca salen del servidor.
+    """
+    if instance.is_shared:
+        pool_container = db.query(WahaContainer).filter(WahaContainer.container_name == instance.container_name).first()
+        if not pool_container:
+            raise HTTPException(status_code=500, detail="El contenedor compartido de la instancia no existe.")
+        return pool_container.internal_url, pool_container.api_key
+    return instance.instance_url, instance.api_key
+
+def _get_own_instance(db: Session, current_user: User) -> InstanceModel:
+    instance = db.query(InstanceModel).filter(InstanceModel.owner_id == current_user.id).first()
+    if not instance:
+        raise HTTPException(status_code=404, detail="No se encontró una instancia para este usuario.")
+    return instance
+
+@router.get("/me/session")
+async def get_session_status(db: Session = Depends(get_db), current_user: User = Depends(get_current_active_user)):
+    """Estado de la sesión de WhatsApp de la instancia (p. ej. SCAN_QR_CODE o WORKING)."""
+    instance = _get_own_instance(db, current_user)
+    if instance.is_hibernated:
+        return {"name": instance.session_name, "status": "HIBERNATED"}
+    instance_url, api_key = _waha_access(db, instance)
+    session = await waha_service.get_session_status(instance_url, api_key, instance.session_name or "default")
+    if session is None:
+        raise HTTPException(status_code=502, detail="No se pudo consultar la sesión en WAHA.")
+    # Solo se devuelve lo que es del tenant, sin detalles del contenedor
+    return {"name": instance.session_name, "status": session.get("status"), "me": session.get("me")}
+
+@router.get("/me/qr")
+async def get_session_qr(db: Session = Depends(get_db), current_user: User = Depends(get_current_active_user)):
+    """Código QR (PNG) para vincular WhatsApp, servido a través del servidor."""
+    instance = _get_own_instance(db, current_user)
+    instance_url, api_key = _waha_access(db, instance)
+    qr = await waha_service.get_session_qr(instance_url, api_key, instance.session_name or "default")
+    if qr is None:
+        raise HTTPException(status_code=409, detail="La sesión no está esperando un código QR. Consulta su estado en /instances/me/session.")
+    return Response(content=qr, media_type="image/png")
@@ -0,0 +1,47 @@
+# routers/usage.py
+from datetime import datetime, timedelta, timezone
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+
+from database.connection import get_db
+from models.user import User
+from models.instance import Instance as InstanceModel
+from routers.auth import get_current_active_user, get_current_admin_user
+from services.usage_meter import usage_meter, USAGE_DAILY_MESSAGE_QUOTA
+
+router = APIRouter(prefix="/usage", tags=["Usage"])
+
+def _usage_report(db: Session, instance: InstanceModel, days: int):
+    since = datetime.now(timezone.utc).date() - timedelta(days=days - 1)
+    return {
+        "instance_name": instance.instance_name,
+        "daily_message_quota": USAGE_DAILY_MESSAGE_QUOTA or None,
+        "today": usage_meter.current(instance.id),
+        "over_quota": usage_meter.over_quota(instance.id),
+        "days": usage_meter.usage(db, instance.id, since),
+    }
+
+@router.get("/")
+def get_my_usage(
+    days: int = Query(30, ge=1, le=366),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """Uso diario de la instancia del usuario actual."""
+    instance = db.query(InstanceModel).filter(InstanceModel.owner_id == current_user.id).first()
+    if not instance:
+        raise HTTPException(status_code=404, detail="No se encontró una instancia para este usuario.")
+    return _usage_report(db, instance, days)
+
+@router.get("/instances/{instance_id}")
+def get_instance_usage(
+    instance_id: int,
+    days: int = Query(30, ge=1, le=366),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_admin_user)
+):
+    """Uso diario de cualquier instancia (solo administradores)."""
+    instance = db.get(InstanceModel, instance_id)
+    if not instance:
+        raise HTTPException(status_code=404, detail="Instancia no encontrada.")
+    return _usage_report(db, instance, days)
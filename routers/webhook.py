@@ -1,19 +1,36 @@
 # routers/webhook.py
-from fastapi import APIRouter, Request, Path, BackgroundTasks, Depends
+from fastapi import APIRouter, Request, Path, BackgroundTasks, Depends, HTTPException
 from sqlalchemy.orm import Session
 import json
+import time
 
 from logger_config import logger
 from database.connection import get_db
-from models.instance import Instance as InstanceModel
 from services import gohighlevel_service
+from services.admission import admission, work_lanes, Ticket
+from services.ack_coalescer import ack_coalescer, link_message
+from services.waha_service import extract_message_id
+from services.usage_meter import usage_meter
+from services.instance_cache import get_instance_by_name
+from services.webhook_fanout import webhook_fanout
+from services.message_archive import message_archiver
+from services.idle_manager import idle_manager
 
 router = APIRouter(prefix="/webhooks", tags=["Webhooks"])
 
-async def process_message(instance_name: str, payload: dict, db: Session):
+async def process_message(instance_name: str, payload: dict, db: Session, ticket: Ticket | None = None):
     """
     Procesa mensajes entrantes y salientes de chats individuales.
+    Libera la plaza de admisión ('ticket') al terminar, sea cual sea el resultado.
     """
+    try:
+        await _process_message(instance_name, payload, db)
+    finally:
+        if ticket:
+            ticket.release()
+
+async def _process_message(instance_name: str, payload: dict, db: Session):
+    started_at = time.monotonic()
     logger.info(f"--- [BG-TASK] Iniciando procesado para la instancia '{instance_name}' ---")
 
     # --- 1. EXTRACCIÓN DE DATOS ---
@@ -40,39 +57,87 @@ async def process_message(instance_name: str, payload: dict, db: Session):
         return
 
     # --- 2. LÓGICA DE GOHIGHLEVEL ---
-    try:
-        instance = db.query(InstanceModel).filter(InstanceModel.instance_name == instance_name).first()
-        if not instance or not all([instance.ghl_access_token, instance.ghl_location_id, instance.ghl_user_id]):
-            logger.error(f"¡FALLO CRÍTICO! La instancia '{instance_name}' no está completamente conectada a GHL.")
-            return
-
-        contact = await gohighlevel_service.get_or_create_contact_in_ghl(
-            phone=phone_number, name=sender_name,
-            location_id=instance.ghl_location_id, access_token=instance.ghl_access_token
-        )
-        if not contact or not contact.get("id"):
-            logger.error(f"¡FALLO! No se pudo obtener ni crear el contacto en GHL para {phone_number}.")
-            return
-        contact_id = contact["id"]
-        
-        logger.info(f"Contacto en GHL listo. ID: {contact_id}. Procediendo a añadir el mensaje...")
-
-        # Esta es la llamada que causaba el error. Ahora la función existe.
-        success = await gohighlevel_service.add_message_to_ghl(
-            contact_id=contact_id,
-            message_body=message_body,
-            access_token=instance.ghl_access_token,
-            user_id=instance.ghl_user_id,
-            direction="outbound" if is_from_me else "inbound"
+    # Todo mensaje de una instancia conocida deja una fila en el archivo, también si falla.
+    instance, archived = None, False
+    def archive(status: str, **fields):
+        nonlocal archived
+        archived = True
+        message_archiver.record(
+            instance.id, phone_number, "outbound" if is_from_me else "inbound", status,
+            latency_ms=int((time.monotonic() - started_at) * 1000),
+            wa_message_id=extract_message_id(message_payload), body=message_body, **fields
         )
 
-        if success:
-            logger.info(f"✅ ¡ÉXITO TOTAL! Mensaje ({direction_log}) del contacto {contact_id} procesado.")
-        else:
-            logger.error(f"❌ ¡FALLO! El envío del mensaje ({direction_log}) a GHL para el contacto {contact_id} no tuvo éxito.")
+    # Carril de baja prioridad: el espejo entrante cede el paso a los envíos de agentes desde GHL.
+    try:
+        async with work_lanes.slot(high_priority=False):
+            instance = get_instance_by_name(db, instance_name)
+            if not instance or not all([instance.ghl_access_token, instance.ghl_location_id, instance.ghl_user_id]):
+                logger.error(f"¡FALLO CRÍTICO! La instancia '{instance_name}' no está completamente conectada a GHL.")
+                if instance:
+                    archive("failed")
+                return
+
+            # Medición de uso en memoria: no añade consultas a la BD
+            usage_meter.increment(instance.id, "outbound_messages" if is_from_me else "inbound_messages")
+            if message_payload.get("hasMedia"):
+                usage_meter.increment(instance.id, "media_messages")
+
+            usage_meter.increment(instance.id, "ghl_calls")
+            contact = await gohighlevel_service.get_or_create_contact_in_ghl(
+                phone=phone_number, name=sender_name,
+                location_id=instance.ghl_location_id, access_token=instance.ghl_access_token
+            )
+            if not contact or not contact.get("id"):
+                logger.error(f"¡FALLO! No se pudo obtener ni crear el contacto en GHL para {phone_number}.")
+                archive("failed")
+                return
+            contact_id = contact["id"]
+        
+            logger.info(f"Contacto en GHL listo. ID: {contact_id}. Procediendo a añadir el mensaje...")
+
+            # Esta es la llamada que causaba el error. Ahora la función existe.
+            usage_meter.increment(instance.id, "ghl_calls", 2) # búsqueda de conversación + creación del mensaje
+            ghl_message = await gohighlevel_service.add_message_to_ghl(
+                contact_id=contact_id,
+                message_body=message_body,
+                access_token=instance.ghl_access_token,
+                user_id=instance.ghl_user_id,
+                direction="outbound" if is_from_me else "inbound"
+            )
+
+            if ghl_message is not None:
+                # Los salientes se relacionan con GHL para reflejar allí sus acuses de entrega/lectura
+                if is_from_me:
+                    link_message(db, instance.id, extract_message_id(message_payload), ghl_message.get("messageId"))
+                logger.info(f"✅ ¡ÉXITO TOTAL! Mensaje ({direction_log}) del contacto {contact_id} procesado.")
+            else:
+                logger.error(f"❌ ¡FALLO! El envío del mensaje ({direction_log}) a GHL para el contacto {contact_id} no tuvo éxito.")
+
+            archive(
+                "success" if ghl_message is not None else "failed", ghl_contact_id=contact_id,
+                ghl_conversation_id=ghl_message.get("conversationId") if ghl_message else None
+            )
+
+            # Reenvío al webhook del tenant: solo encola, la entrega va por su cuenta
+            webhook_fanout.publish(instance, {
+                "event": "message",
+                "direction": "outbound" if is_from_me else "inbound",
+                "phone": phone_number,
+                "sender_name": sender_name,
+                "body": message_body,
+                "has_media": bool(message_payload.get("hasMedia")),
+                "timestamp": message_payload.get("timestamp"),
+                "wa_message_id": extract_message_id(message_payload),
+                "ghl_contact_id": contact_id,
+                "ghl_message_id": ghl_message.get("messageId") if ghl_message else None,
+                "ghl_status": "success" if ghl_message is not None else "failed",
+            })
 
     except Exception as e:
         logger.error(f"Se produjo una excepción inesperada durante el procesamiento de GHL: {e}", exc_info=True)
+        if instance and not archived:
+            archive("failed")
     finally:
         logger.info(f"==================== FIN DE TAREA PARA '{instance_name}' ====================")
 
@@ -89,9 +154,20 @@ async def waha_webhook_receiver(
     los mensajes de chat individuales.
     """
     raw_payload = await request.json()
+    payload_content = raw_payload.get("payload", {})
+
+    # La ruta no lleva autenticación: un nombre inventado no debe consumir plazas de admisión
+    # ni tocar los acuses de otras instancias.
+    if get_instance_by_name(db, instance_name) is None:
+        raise HTTPException(status_code=404, detail="Instancia desconocida.")
+
+    # Acuses de entrega/lectura de nuestros mensajes: se agrupan en memoria y se envían a GHL por lotes.
+    if raw_payload.get("event") == "message.ack":
+        if payload_content.get("fromMe"):
+            ack_coalescer.add(instance_name, extract_message_id(payload_content), payload_content.get("ack"))
+        return {"status": "ack_queued"}
 
     # --- FILTRO SILENCIOSO FINAL ---
-    payload_content = raw_payload.get("payload", {})
     from_id = payload_content.get("from", "")
     
     if from_id == 'status@broadcast' or "@g.us" in from_id:
@@ -100,11 +176,15 @@ async def waha_webhook_receiver(
     if not payload_content.get("body") and not payload_content.get("caption"):
          return {"status": "event_ignored_silently_no_body"}
     
+    # Control de admisión: si estamos sobrecargados respondemos 503 y WAHA reintenta más tarde.
+    ticket = admission.admit("waha_webhook", instance_name)
+    idle_manager.touch(instance_name)
+
     logger.info("==================== INICIO DE WEBHOOK DE CHAT ====================")
     logger.info(f"Webhook de chat válido recibido para la instancia '{instance_name}'")
     logger.info(f"Payload crudo procesado:\n{json.dumps(raw_payload, indent=2)}")
 
-    background_tasks.add_task(process_message, instance_name, raw_payload, db)
+    background_tasks.add_task(process_message, instance_name, raw_payload, db, ticket)
     logger.info("Webhook validado y encolado para procesamiento.")
     
     return {"status": "message_queued"}
\ No newline at end of file
@@ -1,5 +1,5 @@
 # schemas/instance.py
-from pydantic import BaseModel, HttpUrl
+from pydantic import BaseModel, HttpUrl, model_validator
 from typing import Optional
 
 # Esquema para la respuesta de la API.
@@ -7,9 +7,14 @@ from typing import Optional
 class Instance(BaseModel):
     id: int
     instance_name: str
-    instance_url: HttpUrl
-    api_key: str
+    # En modo compartido ni la URL ni la clave del contenedor se exponen: darían acceso
+    # a las sesiones de WhatsApp de los demás tenants alojados en él.
+    instance_url: Optional[HttpUrl] = None
+    api_key: Optional[str] = None
+    is_shared: bool = False
+    session_name: str = "default"
     webhook_url: Optional[HttpUrl] = None
+    webhook_enabled: bool = True
     
     # --- CORRECCIÓN 2 ---
     # El error 'ResponseValidationError' ocurría porque este campo era requerido
@@ -22,6 +27,17 @@ class Instance(BaseModel):
         # Permite que el modelo Pydantic lea los datos desde un objeto de SQLAlchemy.
         from_attributes = True
 
+    @model_validator(mode="after")
+    def hide_shared_container_access(self):
+        if self.is_shared:
+            self.instance_url = None
+            self.api_key = None
+        return self
+
 # Esquema para la creación de instancias (si se necesitara en el futuro).
 class InstanceCreate(BaseModel):
     pass
+
+# Esquema para configurar el webhook de la instancia (n8n, etc.). None lo elimina.
+class InstanceWebhookUpdate(BaseModel):
+    webhook_url: Optional[HttpUrl] = None
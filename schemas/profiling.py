@@ -0,0 +1,9 @@
+# schemas/profiling.py
+from pydantic import BaseModel, Field
+from typing import List
+
+class ProfilingSettings(BaseModel):
+    enabled: bool = False
+    routes: List[str] = [] # Prefijos de ruta a perfilar (vacío = todas)
+    tenants: List[str] = [] # Nombres de instancia presentes en la ruta (vacío = todos; no aplica a send-message)
+    sample_rate: float = Field(1.0, ge=0.0, le=1.0) # Fracción de peticiones que coinciden a perfilar
@@ -0,0 +1,196 @@
+# services/ack_coalescer.py
+import os
+import asyncio
+import time
+import httpx
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import update, tuple_
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert
+
+from logger_config import logger
+from database.connection import SessionLocal
+from models.instance import Instance as InstanceModel
+from models.message_link import MessageLink
+from services import gohighlevel_service
+from services.usage_meter import usage_meter
+
+# Ventana en la que se acumulan los acuses antes de enviarlos a GHL
+ACK_FLUSH_INTERVAL_SECONDS = float(os.getenv("ACK_FLUSH_INTERVAL_SECONDS", 3))
+# Actualizaciones de estado simultáneas hacia GHL en cada lote
+ACK_MAX_CONCURRENT_UPDATES = int(os.getenv("ACK_MAX_CONCURRENT_UPDATES", 10))
+# Ventanas que se retiene un acuse cuyo mensaje aún no está relacionado con GHL
+ACK_MAX_WAIT_WINDOWS = int(os.getenv("ACK_MAX_WAIT_WINDOWS", 5))
+# Días que se conservan las relaciones WhatsApp <-> GHL (pasado ese tiempo no llegan más acuses útiles)
+MESSAGE_LINK_RETENTION_DAYS = int(os.getenv("MESSAGE_LINK_RETENTION_DAYS", 30))
+# Cada cuánto se borran las relaciones caducadas
+MESSAGE_LINK_PURGE_INTERVAL_SECONDS = float(os.getenv("MESSAGE_LINK_PURGE_INTERVAL_SECONDS", 3600))
+
+# Acuses de WhatsApp (campo 'ack' de WAHA) -> estado de mensaje en GHL.
+# 0 (PENDING) y 1 (SERVER) no aportan nada a GHL y se descartan.
+ACK_ERROR = -1
+ACK_TO_GHL_STATUS = {
+    -1: "failed",
+    2: "delivered",
+    3: "read",
+    4: "read", # PLAYED (notas de voz)
+}
+
+def link_message(db: Session, instance_id: int, wa_message_id: str, ghl_message_id: str):
+    """
+    Guarda la relación entre un mensaje de WhatsApp y el mensaje de GHL.
+    Si ya existe (p. ej. el eco de un envío hecho desde GHL), se conserva la primera.
+    """
+    if not (wa_message_id and ghl_message_id):
+        return
+    db.execute(
+        insert(MessageLink)
+        .values(instance_id=instance_id, wa_message_id=wa_message_id, ghl_message_id=ghl_message_id)
+        .on_conflict_do_nothing(index_elements=["wa_message_id"])
+    )
+    db.commit()
+
+def _supersedes(new_ack: int, old_ack: int | None) -> bool:
+    # Un error solo cuenta si aún no se había entregado nada
+    if old_ack is None:
+        return True
+    if new_ack == ACK_ERROR:
+        return old_ack < 2
+    return new_ack > old_ack
+
+class AckCoalescer:
+    """
+    Acumula en memoria los acuses de cada mensaje y, cada ventana, envía a GHL solo
+    el estado final de cada uno. Una ráfaga SERVER -> DEVICE -> READ acaba en una sola llamada.
+    Los acuses se identifican por (instancia, mensaje): una instancia solo puede cambiar
+    el estado de los mensajes que ella misma relacionó con GHL.
+    """
+    def __init__(self, interval: float = ACK_FLUSH_INTERVAL_SECONDS, max_concurrency: int = ACK_MAX_CONCURRENT_UPDATES):
+        self.interval = interval
+        self.max_concurrency = max_concurrency
+        self._pending: dict[tuple[str, str], int] = {} # (instance_name, wa_message_id) -> acuse
+        self._waiting: dict[tuple[str, str], int] = {} # misma clave -> ventanas esperando su relación
+        self._task = None
+        self._last_purge = 0.0
+
+    def add(self, instance_name: str, wa_message_id: str, ack: int):
+        if ack not in ACK_TO_GHL_STATUS or not wa_message_id:
+            return
+        key = (instance_name, wa_message_id)
+        if _supersedes(ack, self._pending.get(key)):
+            self._pending[key] = ack
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error al enviar el lote de acuses a GHL: {e}", exc_info=True)
+            if time.monotonic() - self._last_purge >= MESSAGE_LINK_PURGE_INTERVAL_SECONDS:
+                self._last_purge = time.monotonic()
+                try:
+                    await asyncio.to_thread(_purge_links)
+                except Exception as e:
+                    logger.error(f"Error al borrar relaciones de mensajes caducadas: {e}", exc_info=True)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    async def flush(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+
+        # La consulta y el guardado son síncronos: se hacen fuera del bucle de eventos
+        rows = await asyncio.to_thread(_load_links, list(batch.keys()))
+        self._requeue_unlinked(batch, {(row.instance_name, row.wa_message_id) for row in rows})
+        updates = [
+            row for row in rows
+            if row.ghl_access_token and _supersedes(batch[(row.instance_name, row.wa_message_id)], row.last_ack)
+        ]
+        if not updates:
+            return
+
+        sent: dict[int, int] = {} # id de la relación -> acuse enviado
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with httpx.AsyncClient(timeout=gohighlevel_service.GHL_API_TIMEOUT) as client:
+            async def push(row):
+                ack = batch[(row.instance_name, row.wa_message_id)]
+                async with semaphore:
+                    usage_meter.increment(row.instance_id, "ghl_calls")
+                    if await gohighlevel_service.update_message_status(row.ghl_message_id, ACK_TO_GHL_STATUS[ack], row.ghl_access_token, client):
+                        sent[row.id] = ack
+            results = await asyncio.gather(*(push(row) for row in updates), return_exceptions=True)
+
+        if sent:
+            await asyncio.to_thread(_save_acks, sent)
+        failures = sum(1 for r in results if isinstance(r, Exception))
+        logger.info(f"Acuses: {len(batch)} recibidos, {len(updates)} estados enviados a GHL ({failures} con excepción).")
+
+    def _requeue_unlinked(self, batch: dict[tuple[str, str], int], linked: set[tuple[str, str]]):
+        """
+        El acuse puede llegar antes de que el mensaje quede relacionado con GHL
+        (el espejo a GHL aún está en curso): se reintenta en las siguientes ventanas.
+        """
+        for key in linked:
+            self._waiting.pop(key, None)
+        for key, ack in batch.items():
+            if key in linked:
+                continue
+            windows = self._waiting.get(key, 0) + 1
+            if windows >= ACK_MAX_WAIT_WINDOWS:
+                self._waiting.pop(key, None)
+                continue
+            self._waiting[key] = windows
+            self.add(*key, ack)
+
+def _load_links(keys: list[tuple[str, str]]) -> list:
+    """
+    Una sola consulta para todo el lote. Se cruza por (nombre de instancia, mensaje):
+    un acuse recibido en el webhook de otra instancia no encuentra la relación.
+    """
+    db = SessionLocal()
+    try:
+        return (
+            db.query(
+                MessageLink.id, InstanceModel.instance_name, MessageLink.wa_message_id, MessageLink.instance_id,
+                MessageLink.ghl_message_id, MessageLink.last_ack, InstanceModel.ghl_access_token
+            )
+            .join(InstanceModel, InstanceModel.id == MessageLink.instance_id)
+            .filter(tuple_(InstanceModel.instance_name, MessageLink.wa_message_id).in_(keys))
+            .all()
+        )
+    finally:
+        db.close()
+
+def _save_acks(sent: dict[int, int]):
+    """Guarda el último acuse enviado a GHL de cada mensaje."""
+    db = SessionLocal()
+    try:
+        for link_id, ack in sent.items():
+            db.execute(update(MessageLink).where(MessageLink.id == link_id).values(last_ack=ack))
+        db.commit()
+    finally:
+        db.close()
+
+def _purge_links():
+    """Borra las relaciones más antiguas que MESSAGE_LINK_RETENTION_DAYS."""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=MESSAGE_LINK_RETENTION_DAYS)
+    db = SessionLocal()
+    try:
+        deleted = db.query(MessageLink).filter(MessageLink.created_at < cutoff).delete(synchronize_session=False)
+        db.commit()
+        if deleted:
+            logger.info(f"Borradas {deleted} relaciones de mensajes con más de {MESSAGE_LINK_RETENTION_DAYS} días.")
+    finally:
+        db.close()
+
+ack_coalescer = AckCoalescer()
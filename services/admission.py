@@ -0,0 +1,132 @@
+# services/admission.py
+import os
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import HTTPException, status
+
+from logger_config import logger
+
+# --- Límites de admisión ---
+# Peticiones en curso (aceptadas y aún sin terminar de procesar) por endpoint y por tenant.
+MAX_INFLIGHT = {
+    "waha_webhook": int(os.getenv("ADMISSION_MAX_INFLIGHT_WEBHOOK", 200)),
+    "ghl_send": int(os.getenv("ADMISSION_MAX_INFLIGHT_SEND", 100)),
+}
+MAX_INFLIGHT_PER_TENANT = int(os.getenv("ADMISSION_MAX_INFLIGHT_PER_TENANT", 20))
+RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", 5))
+
+# --- Carriles de prioridad ---
+# Huecos de trabajo concurrente (llamadas a GHL/WAHA y BD) compartidos por todos los endpoints.
+# Una parte queda reservada para los envíos salientes de GHL, que nunca esperan detrás del espejo entrante.
+WORK_SLOTS = int(os.getenv("WORK_SLOTS", 20))
+HIGH_PRIORITY_RESERVED_SLOTS = int(os.getenv("HIGH_PRIORITY_RESERVED_SLOTS", 5))
+
+class Ticket:
+    """Plaza concedida por el control de admisión. Se libera una sola vez."""
+    def __init__(self, controller, endpoint: str, tenant: str):
+        self.controller = controller
+        self.endpoint = endpoint
+        self.tenant = tenant
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.controller._release(self)
+
+class AdmissionController:
+    """
+    Cuenta las peticiones en curso por endpoint y por tenant y rechaza las que superan
+    el presupuesto. Todo ocurre en el event loop, así que no hace falta bloqueo.
+    """
+    def __init__(self, limits: dict, per_tenant_limit: int):
+        self.limits = limits
+        self.per_tenant_limit = per_tenant_limit
+        self.inflight = {endpoint: 0 for endpoint in limits}
+        self.inflight_by_tenant = {}
+        self.rejected = {endpoint: 0 for endpoint in limits}
+
+    def try_admit(self, endpoint: str, tenant: str):
+        key = (endpoint, tenant)
+        if self.inflight[endpoint] >= self.limits[endpoint] or self.inflight_by_tenant.get(key, 0) >= self.per_tenant_limit:
+            self.rejected[endpoint] += 1
+            return None
+        self.inflight[endpoint] += 1
+        self.inflight_by_tenant[key] = self.inflight_by_tenant.get(key, 0) + 1
+        return Ticket(self, endpoint, tenant)
+
+    def admit(self, endpoint: str, tenant: str) -> Ticket:
+        """
+        Concede una plaza o lanza un 503 con Retry-After para que WAHA/GHL reintenten más tarde.
+        """
+        ticket = self.try_admit(endpoint, tenant)
+        if ticket is None:
+            logger.warning(f"Admisión rechazada en '{endpoint}' para el tenant '{tenant}' (sobrecarga).")
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Servicio sobrecargado. Reintente más tarde.",
+                headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+            )
+        return ticket
+
+    def _release(self, ticket: Ticket):
+        key = (ticket.endpoint, ticket.tenant)
+        self.inflight[ticket.endpoint] -= 1
+        remaining = self.inflight_by_tenant.get(key, 1) - 1
+        if remaining:
+            self.inflight_by_tenant[key] = remaining
+        else:
+            self.inflight_by_tenant.pop(key, None)
+
+    def stats(self) -> dict:
+        return {
+            "limits": self.limits,
+            "per_tenant_limit": self.per_tenant_limit,
+            "inflight": self.inflight,
+            "rejected": self.rejected,
+            "busiest_tenants": sorted(
+                ({"endpoint": e, "tenant": t, "inflight": n} for (e, t), n in self.inflight_by_tenant.items()),
+                key=lambda row: row["inflight"], reverse=True
+            )[:10],
+        }
+
+class PriorityLimiter:
+    """
+    Limita el trabajo concurrente con dos carriles: el de alta prioridad puede usar todos
+    los huecos; el de baja prioridad deja libres los reservados y cede el paso mientras
+    haya peticiones de alta prioridad esperando.
+    """
+    def __init__(self, slots: int, reserved_for_high: int):
+        self.slots = slots
+        self.low_priority_limit = max(1, slots - reserved_for_high)
+        self.in_use = 0
+        self._high_waiting = 0
+        self._condition = asyncio.Condition()
+
+    def _can_enter(self, high_priority: bool) -> bool:
+        if high_priority:
+            return self.in_use < self.slots
+        return self.in_use < self.low_priority_limit and self._high_waiting == 0
+
+    @asynccontextmanager
+    async def slot(self, high_priority: bool = False):
+        async with self._condition:
+            if high_priority:
+                self._high_waiting += 1
+            try:
+                await self._condition.wait_for(lambda: self._can_enter(high_priority))
+            finally:
+                if high_priority:
+                    self._high_waiting -= 1
+                    # Los de baja prioridad pueden haber quedado desbloqueados
+                    self._condition.notify_all()
+            self.in_use += 1
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self.in_use -= 1
+                self._condition.notify_all()
+
+admission = AdmissionController(MAX_INFLIGHT, MAX_INFLIGHT_PER_TENANT)
+work_lanes = PriorityLimiter(WORK_SLOTS, HIGH_PRIORITY_RESERVED_SLOTS)
@@ -0,0 +1,61 @@
+# services/cache.py
+import os
+import time
+import threading
+
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", 300))
+
+# Todas las cachés del proceso por espacio de nombres, para que el bus de invalidación las encuentre
+CACHES = {}
+
+class LocalCache:
+    """
+    Caché en memoria de un proceso con caducidad. El TTL es solo una red de seguridad:
+    las escrituras se propagan a todos los workers por services/invalidation_bus.py.
+    Cada clave lleva una generación que sube al invalidarla: quien carga un valor toma la
+    generación antes de leer la BD y lo guarda con set(..., generation); si la clave se invalidó
+    entre medias, el valor (quizá anterior al commit) se descarta en lugar de quedarse cacheado.
+    """
+    def __init__(self, namespace: str, ttl: float = CACHE_TTL_SECONDS):
+        self.namespace = namespace
+        self.ttl = ttl
+        self._entries = {}
+        self._generations = {}
+        self._epoch = 0 # Sube con clear(): invalida todas las claves a la vez
+        self._lock = threading.Lock()
+        CACHES[namespace] = self
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at < time.monotonic():
+            self._entries.pop(key, None)
+            return None
+        return value
+
+    def generation(self, key):
+        with self._lock:
+            return (self._epoch, self._generations.get(key, 0))
+
+    def set(self, key, value, generation=None):
+        with self._lock:
+            if generation is not None and generation != (self._epoch, self._generations.get(key, 0)):
+                return # Se invalidó mientras se cargaba
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+
+    def evict(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._generations[key] = self._generations.get(key, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+            self._epoch += 1
+
+def clear_all():
+    for cache in CACHES.values():
+        cache.clear()
@@ -0,0 +1,168 @@
+# services/docker_scheduler.py
+import os
+import docker
+
+from logger_config import logger
+from database.connection import SessionLocal
+from models.docker_host_state import DockerHostState
+
+# --- Configuración del planificador ---
+# DOCKER_HOSTS define los nodos donde pueden vivir los contenedores de WAHA, separados por comas:
+#   "nodo1=tcp://10.0.0.11:2375|10.0.0.11,nodo2=tcp://10.0.0.12:2375|10.0.0.12"
+# Cada entrada es nombre=URL del daemon|dirección por la que se alcanzan sus puertos publicados.
+# Si no se define, se usa solo el Docker local (el socket montado en docker-compose.yaml).
+DOCKER_HOSTS = os.getenv("DOCKER_HOSTS", "")
+SCHEDULER_STRATEGY = os.getenv("DOCKER_SCHEDULER_STRATEGY", "binpack") # "binpack" o "least_loaded"
+MAX_CONTAINERS_PER_HOST = int(os.getenv("DOCKER_MAX_CONTAINERS_PER_HOST", 100))
+WAHA_CONTAINER_MEMORY_MB = int(os.getenv("WAHA_CONTAINER_MEMORY_MB", 400))
+WAHA_CONTAINER_CPUS = float(os.getenv("WAHA_CONTAINER_CPUS", 0.25))
+
+LOCAL_HOST_NAME = "local"
+WAHA_LABEL = "saas.waha"
+
+class NoCapacityError(Exception):
+    """Ningún nodo de Docker tiene capacidad para otro contenedor de WAHA."""
+
+class DockerHost:
+    """
+    Un nodo de Docker. 'client_factory' permite inyectar clientes falsos en pruebas.
+    """
+    def __init__(self, name: str, base_url: str | None, public_address: str, internal_address: str | None = None, client_factory=None):
+        self.name = name
+        self.base_url = base_url
+        self.public_address = public_address
+        self.internal_address = internal_address or public_address
+        self._client_factory = client_factory
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            if self._client_factory:
+                self._client = self._client_factory(self)
+            elif self.base_url:
+                self._client = docker.DockerClient(base_url=self.base_url)
+            else:
+                self._client = docker.from_env()
+        return self._client
+
+    def public_url(self, port: int) -> str:
+        return f"http://{self.public_address}:{port}"
+
+    def internal_url(self, port: int) -> str:
+        return f"http://{self.internal_address}:{port}"
+
+    def capacity(self, draining: bool = False) -> dict:
+        """
+        Capacidad libre estimada a partir de la memoria y CPUs del nodo y del número
+        de contenedores de WAHA en marcha, usando la reserva por contenedor configurada.
+        """
+        info = self.client.info()
+        running = len(self.client.containers.list(filters={"label": WAHA_LABEL}))
+        memory_mb = info.get("MemTotal", 0) // (1024 * 1024)
+        cpus = info.get("NCPU", 0)
+        return {
+            "host": self.name,
+            "draining": draining,
+            "containers": running,
+            "free_containers": MAX_CONTAINERS_PER_HOST - running,
+            "free_memory_mb": memory_mb - running * WAHA_CONTAINER_MEMORY_MB,
+            "free_cpus": round(cpus - running * WAHA_CONTAINER_CPUS, 2),
+        }
+
+def _fits(capacity: dict) -> bool:
+    return (
+        capacity["free_containers"] >= 1
+        and capacity["free_memory_mb"] >= WAHA_CONTAINER_MEMORY_MB
+        and capacity["free_cpus"] >= WAHA_CONTAINER_CPUS
+    )
+
+def _headroom(capacity: dict) -> float:
+    """Cuántos contenedores más caben en el nodo según el recurso más escaso."""
+    return min(
+        capacity["free_containers"],
+        capacity["free_memory_mb"] / WAHA_CONTAINER_MEMORY_MB,
+        capacity["free_cpus"] / WAHA_CONTAINER_CPUS,
+    )
+
+def draining_hosts_from_db() -> set[str]:
+    """Nodos marcados como 'draining' en la base de datos (visibles para todos los workers)."""
+    db = SessionLocal()
+    try:
+        return {name for (name,) in db.query(DockerHostState.name).filter(DockerHostState.draining.is_(True))}
+    finally:
+        db.close()
+
+class DockerScheduler:
+    """
+    Decide en qué nodo de Docker arrancar cada contenedor de WAHA.
+    - binpack: llena primero el nodo con menos hueco que aún tenga sitio.
+    - least_loaded: usa el nodo con más hueco libre.
+    Los nodos en 'draining' se consultan con 'draining_lookup' (en producción, la base de datos).
+    """
+    def __init__(self, hosts: list[DockerHost], strategy: str = SCHEDULER_STRATEGY, draining_lookup=None):
+        if not hosts:
+            raise ValueError("El planificador necesita al menos un nodo de Docker.")
+        if strategy not in ("binpack", "least_loaded"):
+            raise ValueError(f"Estrategia de planificación desconocida: {strategy}")
+        self.hosts = {host.name: host for host in hosts}
+        self.strategy = strategy
+        self.draining_lookup = draining_lookup or set
+
+    @classmethod
+    def from_env(cls, spec: str = DOCKER_HOSTS, client_factory=None, draining_lookup=None):
+        if not spec.strip():
+            # Comportamiento original: el Docker local, accesible desde los contenedores por host.docker.internal.
+            return cls([DockerHost(LOCAL_HOST_NAME, None, "localhost", "host.docker.internal", client_factory)], draining_lookup=draining_lookup)
+
+        hosts = []
+        for entry in spec.split(","):
+            name, _, target = entry.strip().partition("=")
+            base_url, _, address = target.partition("|")
+            if not (name and base_url and address):
+                raise ValueError(f"Entrada de DOCKER_HOSTS inválida: '{entry}'")
+            hosts.append(DockerHost(name, base_url, address, client_factory=client_factory))
+        return cls(hosts, draining_lookup=draining_lookup)
+
+    def get_host(self, name: str | None) -> DockerHost:
+        # Las instancias anteriores al planificador no tienen nodo guardado: viven en el primero.
+        if not name:
+            return self.hosts.get(LOCAL_HOST_NAME) or next(iter(self.hosts.values()))
+        if name not in self.hosts:
+            raise ValueError(f"Nodo de Docker desconocido: '{name}'")
+        return self.hosts[name]
+
+    def capacities(self) -> list[dict]:
+        draining = self.draining_lookup()
+        result = []
+        for host in self.hosts.values():
+            try:
+                result.append(host.capacity(draining=host.name in draining))
+            except Exception as e:
+                logger.error(f"No se pudo consultar la capacidad del nodo '{host.name}': {e}")
+                result.append({"host": host.name, "draining": host.name in draining, "error": str(e)})
+        return result
+
+    def place(self, exclude: set[str] | None = None) -> DockerHost:
+        """
+        Elige el nodo para un nuevo contenedor. Lanza NoCapacityError si no cabe en ninguno.
+        """
+        candidates = []
+        for capacity in self.capacities():
+            host = self.hosts[capacity["host"]]
+            if capacity["draining"] or "error" in capacity or (exclude and host.name in exclude):
+                continue
+            if _fits(capacity):
+                candidates.append((_headroom(capacity), host))
+
+        if not candidates:
+            raise NoCapacityError("No hay ningún nodo de Docker con capacidad disponible.")
+
+        if self.strategy == "binpack":
+            headroom, host = min(candidates, key=lambda c: c[0])
+        else:
+            headroom, host = max(candidates, key=lambda c: c[0])
+        logger.info(f"Planificador ({self.strategy}): nodo '{host.name}' elegido (hueco para {headroom:.1f} contenedores).")
+        return host
+
+scheduler = DockerScheduler.from_env(draining_lookup=draining_hosts_from_db)
@@ -0,0 +1,146 @@
+# services/docker_service.py
+import os
+import time
+import requests
+
+from logger_config import logger
+from services.docker_scheduler import WAHA_LABEL
+
+DOCKER_NETWORK_NAME = os.getenv("DOCKER_NETWORK", "my_saas_network")
+WAHA_IMAGE = os.getenv("WAHA_IMAGE", "devlikeapro/whatsapp-http-api:latest")
+# URL por la que los contenedores de WAHA alcanzan nuestro backend (en nodos remotos, su IP o dominio).
+BACKEND_WEBHOOK_BASE_URL = os.getenv("BACKEND_WEBHOOK_BASE_URL", "http://host.docker.internal:8000")
+# Versión de la configuración de webhook que aplica configure_waha_session (eventos, reintentos).
+# Al cambiarla, services/session_sync.py reconfigura al arrancar las sesiones que ya existían.
+WEBHOOK_CONFIG_VERSION = 1
+
+def webhook_url_for(instance_name: str) -> str:
+    return f"{BACKEND_WEBHOOK_BASE_URL}/api/webhooks/waha/{instance_name}"
+
+def wait_for_instance_ready(instance_url: str, api_key: str, timeout: int = 60):
+    start_time = time.time()
+    health_check_url = f"{instance_url}/api/server/status"
+    logger.info(f"Verificando la instancia en: {health_check_url}")
+    
+    while time.time() - start_time < timeout:
+        try:
+            response = requests.get(health_check_url, headers={"X-Api-Key": api_key}, timeout=5)
+            if response.status_code == 200:
+                logger.info(f"¡ÉXITO! La instancia en {instance_url} está lista.")
+                return True
+        except requests.exceptions.RequestException:
+            logger.info(f"Esperando a la instancia en {instance_url}...")
+        
+        time.sleep(2)
+        
+    raise TimeoutError(f"La nueva instancia de API no respondió a tiempo en {instance_url}")
+
+SESSIONS_PATH = "/app/.sessions"
+
+def start_waha_container(client, container_name: str, api_key: str, image: str = WAHA_IMAGE, sessions_archive: bytes | None = None):
+    """
+    Arranca un contenedor de WAHA y devuelve (contenedor, puerto publicado).
+    El puerto lo asigna el propio daemon, así funciona igual en nodos remotos.
+    'sessions_archive' (un tar de SESSIONS_PATH, ver export_sessions) se copia antes de arrancar,
+    para que el contenedor recupere los logins de WhatsApp de otro.
+    """
+    container = client.containers.create(
+        image,
+        name=container_name,
+        ports={f"3000/tcp": None},
+        # Las sesiones se guardan en un volumen propio y se rearrancan al arrancar el contenedor,
+        # así un contenedor hibernado (detenido) recupera su sesión de WhatsApp al despertar.
+        environment={"WAHA_API_KEY": api_key, "WHATSAPP_RESTART_ALL_SESSIONS": "True"},
+        volumes={f"{container_name}_sessions": {"bind": SESSIONS_PATH, "mode": "rw"}},
+        labels={WAHA_LABEL: "1"},
+        network=DOCKER_NETWORK_NAME,
+        extra_hosts={"host.docker.internal": "host-gateway"}
+    )
+    if sessions_archive is not None:
+        container.put_archive(os.path.dirname(SESSIONS_PATH), sessions_archive)
+    container.start()
+    port = published_port(container)
+    logger.info(f"Contenedor '{container.name}' iniciado exitosamente en el puerto {port}.")
+    return container, port
+
+def export_sessions(container) -> bytes:
+    """Tar con los datos de sesión de WhatsApp del contenedor (funciona también si está detenido)."""
+    stream, _ = container.get_archive(SESSIONS_PATH)
+    return b"".join(stream)
+
+def published_port(container) -> int:
+    """Puerto del host publicado para la API de WAHA (cambia cada vez que el contenedor arranca)."""
+    container.reload()
+    return int(container.ports["3000/tcp"][0]["HostPort"])
+
+def wait_for_session_working(instance_url: str, api_key: str, session_name: str = "default", timeout: int = 60):
+    """
+    Espera a que la sesión de WhatsApp esté en estado WORKING (conectada y lista para enviar).
+    """
+    start_time = time.time()
+    endpoint = f"{instance_url}/api/sessions/{session_name}"
+    while time.time() - start_time < timeout:
+        try:
+            response = requests.get(endpoint, headers={"X-Api-Key": api_key}, timeout=5)
+            if response.status_code == 200 and response.json().get("status") == "WORKING":
+                logger.info(f"La sesión '{session_name}' en {instance_url} está lista.")
+                return True
+        except requests.exceptions.RequestException:
+            pass
+        logger.info(f"Esperando a la sesión '{session_name}' en {instance_url}...")
+        time.sleep(2)
+
+    raise TimeoutError(f"La sesión '{session_name}' no quedó lista a tiempo en {instance_url}")
+
+def discard_container(container):
+    """
+    Vuelca los logs de un contenedor fallido y lo elimina. Nunca lanza excepciones.
+    """
+    try: 
+        logs = container.logs().decode('utf-8')
+        logger.error(f"Logs del contenedor fallido '{container.name}':\n{logs}")
+        container.stop(); container.remove()
+    except: pass
+
+def configure_waha_session(instance_url: str, api_key: str, webhook_target_url: str, session_name: str = "default", create: bool = False):
+    """
+    Configura una sesión de WAHA para que use nuestro webhook.
+    Con create=True la sesión se crea (y arranca) en un contenedor multi-sesión;
+    si no, se actualiza la sesión existente (la 'default' de un contenedor dedicado).
+    """
+    headers = {"X-Api-Key": api_key, "Content-Type": "application/json"}
+    payload = {
+      "config": {
+        "webhooks": [
+          {
+            "url": webhook_target_url,
+            "events": [
+              "message",
+              "message.ack",
+              "session.status"
+            ],
+            # Si respondemos 503 por sobrecarga, WAHA reintenta la entrega
+            "retries": {
+              "policy": "exponential",
+              "delaySeconds": 2,
+              "attempts": 5
+            }
+          }
+        ]
+      }
+    }
+    
+    logger.info(f"Configurando sesión '{session_name}' para la instancia en {instance_url}...")
+    logger.info(f"URL del Webhook a configurar: {webhook_target_url}")
+
+    try:
+        if create:
+            payload.update({"name": session_name, "start": True})
+            response = requests.post(f"{instance_url}/api/sessions", headers=headers, json=payload, timeout=10)
+        else:
+            response = requests.put(f"{instance_url}/api/sessions/{session_name}", headers=headers, json=payload, timeout=10)
+        response.raise_for_status()
+        logger.info(f"Sesión '{session_name}' configurada exitosamente. Respuesta: {response.json()}")
+    except requests.exceptions.RequestException as e:
+        logger.error(f"FALLO CRÍTICO al configurar la sesión de la instancia: {e}")
+        raise
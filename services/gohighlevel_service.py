@@ -43,9 +43,10 @@ async def get_or_create_contact_in_ghl(phone: str, name: str, location_id: str,
             return None
 
 # --- FUNCIÓN DE MENSAJES FINAL Y DEFINITIVA ---
-async def add_message_to_ghl(contact_id: str, message_body: str, access_token: str, user_id: str, direction: str) -> bool:
+async def add_message_to_ghl(contact_id: str, message_body: str, access_token: str, user_id: str, direction: str) -> Optional[Dict[str, Any]]:
     """
     Añade un mensaje (entrante o saliente) a una conversación.
+    Devuelve la respuesta de GHL (con 'messageId') o None si falla.
     """
     try:
         headers = await _get_auth_headers(access_token)
@@ -88,11 +89,29 @@ async def add_message_to_ghl(contact_id: str, message_body: str, access_token: s
             response = await client.post(url, headers=headers, json=payload)
             response.raise_for_status()
             logger.info(f"GHL API Response: Mensaje para {contact_id} añadido exitosamente.")
-            return True
+            return response.json()
             
     except httpx.HTTPStatusError as e:
         logger.error(f"Error HTTP al añadir mensaje en GHL. Status: {e.response.status_code}. Response: {e.response.text}")
-        return False
+        return None
     except Exception as e:
         logger.error(f"Excepción inesperada al intentar añadir mensaje: {e}", exc_info=True)
+        return None
+
+async def update_message_status(message_id: str, status: str, access_token: str, client: httpx.AsyncClient) -> bool:
+    """
+    Actualiza el estado de entrega de un mensaje en GHL ('delivered', 'read' o 'failed').
+    Recibe el cliente HTTP para poder reutilizar conexiones al enviar lotes.
+    """
+    try:
+        headers = await _get_auth_headers(access_token)
+        url = f"{GHL_API_URL}/conversations/messages/{message_id}/status"
+        response = await client.put(url, headers=headers, json={"status": status})
+        response.raise_for_status()
+        return True
+    except httpx.HTTPStatusError as e:
+        logger.error(f"Error HTTP al actualizar el estado del mensaje {message_id} en GHL. Status: {e.response.status_code}. Response: {e.response.text}")
+        return False
+    except Exception as e:
+        logger.error(f"Excepción inesperada al actualizar el estado del mensaje {message_id}: {e}", exc_info=True)
         return False
\ No newline at end of file
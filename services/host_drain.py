@@ -0,0 +1,173 @@
+# services/host_drain.py
+import threading
+from datetime import datetime, timezone
+from sqlalchemy import or_
+from sqlalchemy.dialects.postgresql import insert
+
+from logger_config import logger
+from database.connection import SessionLocal
+from models.instance import Instance as InstanceModel
+from models.waha_container import WahaContainer
+from models.docker_host_state import DockerHostState
+from services.docker_scheduler import scheduler, DockerHost
+from services.docker_service import (
+    WAHA_IMAGE, start_waha_container, wait_for_instance_ready,
+    configure_waha_session, discard_container, webhook_url_for, export_sessions, WEBHOOK_CONFIG_VERSION
+)
+from services.waha_pool import SHARED_IMAGE
+from services.instance_cache import invalidate_instance
+
+def _on_host(column, host: DockerHost):
+    # Las filas anteriores al planificador no tienen nodo guardado y viven en el nodo por defecto.
+    if host is scheduler.get_host(None):
+        return or_(column == host.name, column.is_(None))
+    return column == host.name
+
+def _move_container(source: DockerHost, container_name: str, api_key: str, image: str, sessions: list[tuple[str, str]]):
+    """
+    Mueve un contenedor a otro nodo conservando los logins de WhatsApp: detiene el original,
+    copia sus datos de sesión al nuevo contenedor y vuelve a configurar sus sesiones
+    (ya existen gracias a la copia, así que se actualizan, no se crean).
+    El original queda detenido (no se elimina) como respaldo; si algo falla, se vuelve a arrancar.
+    'sessions' es una lista de (session_name, instance_name).
+    Devuelve (nodo destino, puerto).
+    """
+    target = scheduler.place(exclude={source.name})
+    old_container = source.client.containers.get(container_name)
+    # Se detiene primero: los datos quedan consistentes y WhatsApp no ve dos clientes a la vez
+    old_container.stop(timeout=10)
+
+    container = None
+    try:
+        sessions_archive = export_sessions(old_container)
+        container, port = start_waha_container(target.client, container_name, api_key, image=image, sessions_archive=sessions_archive)
+        internal_url = target.internal_url(port)
+        wait_for_instance_ready(internal_url, api_key)
+        for session_name, instance_name in sessions:
+            configure_waha_session(internal_url, api_key, webhook_url_for(instance_name), session_name=session_name)
+    except Exception:
+        if container:
+            discard_container(container)
+        try:
+            old_container.start()
+        except Exception as e:
+            logger.error(f"No se pudo volver a arrancar '{container_name}' en el nodo '{source.name}': {e}")
+        raise
+
+    logger.info(f"Contenedor '{container_name}' migrado de '{source.name}' a '{target.name}'. El original queda detenido como respaldo.")
+    return target, port
+
+def set_draining(host_name: str, draining: bool):
+    """Guarda en la base de datos si el nodo admite contenedores nuevos; lo respetan todos los workers."""
+    db = SessionLocal()
+    try:
+        db.execute(
+            insert(DockerHostState)
+            .values(name=host_name, draining=draining)
+            .on_conflict_do_update(index_elements=["name"], set_={"draining": draining, "updated_at": datetime.now(timezone.utc)})
+        )
+        db.commit()
+    finally:
+        db.close()
+
+# Estado de los vaciados lanzados desde este proceso, por nodo
+drain_jobs: dict[str, dict] = {}
+_jobs_lock = threading.Lock()
+
+def start_drain(host_name: str) -> dict | None:
+    """
+    Lanza el vaciado del nodo en un hilo aparte y devuelve su estado inicial,
+    o None si ya hay uno en curso para ese nodo.
+    """
+    with _jobs_lock:
+        job = drain_jobs.get(host_name)
+        if job and job["status"] == "running":
+            return None
+        job = drain_jobs[host_name] = {
+            "host": host_name, "status": "running", "started_at": datetime.now(timezone.utc).isoformat(),
+            "finished_at": None, "migrated": [], "failed": [],
+        }
+    threading.Thread(target=_run_drain, args=(job,), name=f"drain-{host_name}", daemon=True).start()
+    return job
+
+def _run_drain(job: dict):
+    try:
+        drain_host(job["host"], job)
+        job["status"] = "done"
+    except Exception as e:
+        logger.error(f"Vaciado del nodo '{job['host']}' interrumpido: {e}", exc_info=True)
+        job["status"] = "error"
+        job["error"] = str(e)
+    finally:
+        job["finished_at"] = datetime.now(timezone.utc).isoformat()
+
+def drain_host(host_name: str, job: dict):
+    """
+    Marca un nodo como 'draining' (no recibe contenedores nuevos) y migra a otros nodos
+    todos sus contenedores de WAHA, tanto dedicados como compartidos, con sus sesiones.
+    El progreso se va anotando en 'job'. El nodo sigue en 'draining' al terminar,
+    hasta que se reactive con set_draining(host_name, False).
+    """
+    source = scheduler.get_host(host_name)
+    set_draining(source.name, True)
+    logger.info(f"Vaciando el nodo de Docker '{source.name}'...")
+
+    migrated, failed = job["migrated"], job["failed"]
+    db = SessionLocal()
+    try:
+        _drain(db, source, migrated, failed)
+    finally:
+        db.close()
+    logger.info(f"Vaciado de '{source.name}' terminado: {len(migrated)} migrados, {len(failed)} fallidos.")
+
+def _drain(db, source: DockerHost, migrated: list, failed: list):
+    # --- Contenedores compartidos: se mueven con todas sus sesiones ---
+    pool_containers = db.query(WahaContainer).filter(_on_host(WahaContainer.docker_host, source)).all()
+    for pool_container in pool_containers:
+        instances = db.query(InstanceModel).filter(InstanceModel.container_name == pool_container.container_name).all()
+        try:
+            target, port = _move_container(
+                source, pool_container.container_name, pool_container.api_key, SHARED_IMAGE,
+                [(i.session_name, i.instance_name) for i in instances]
+            )
+            pool_container.docker_host = target.name
+            pool_container.instance_url = target.public_url(port)
+            pool_container.internal_url = target.internal_url(port)
+            for instance in instances:
+                instance.docker_host = target.name
+                instance.instance_url = pool_container.instance_url
+                instance.webhook_config_version = WEBHOOK_CONFIG_VERSION
+                invalidate_instance(db, instance)
+            db.commit()
+            migrated.append(pool_container.container_name)
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Fallo al migrar el contenedor compartido '{pool_container.container_name}': {e}", exc_info=True)
+            failed.append({"container": pool_container.container_name, "error": str(e)})
+
+    # --- Contenedores dedicados: una instancia con su sesión 'default' ---
+    shared_names = db.query(WahaContainer.container_name)
+    dedicated = (
+        db.query(InstanceModel)
+        .filter(_on_host(InstanceModel.docker_host, source))
+        .filter(or_(InstanceModel.container_name.is_(None), InstanceModel.container_name.not_in(shared_names)))
+        .all()
+    )
+    for instance in dedicated:
+        container_name = instance.container_name or instance.instance_name
+        try:
+            target, port = _move_container(
+                source, container_name, instance.api_key, WAHA_IMAGE,
+                [(instance.session_name or "default", instance.instance_name)]
+            )
+            instance.docker_host = target.name
+            instance.instance_url = target.public_url(port)
+            instance.container_name = container_name
+            instance.webhook_config_version = WEBHOOK_CONFIG_VERSION
+            invalidate_instance(db, instance)
+            db.commit()
+            migrated.append(container_name)
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Fallo al migrar la instancia '{instance.instance_name}': {e}", exc_info=True)
+            failed.append({"container": container_name, "error": str(e)})
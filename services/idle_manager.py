@@ -0,0 +1,318 @@
+# services/idle_manager.py
+import os
+import time
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple, Callable, Awaitable
+from sqlalchemy import update, bindparam, func, or_
+
+from logger_config import logger
+from database.connection import SessionLocal
+from models.instance import Instance as InstanceModel
+from models.waha_container import WahaContainer
+from services.docker_scheduler import scheduler, WAHA_LABEL
+from services.docker_service import published_port, wait_for_instance_ready, wait_for_session_working, configure_waha_session, webhook_url_for, WEBHOOK_CONFIG_VERSION
+from services.instance_cache import invalidate_instance, get_instance_by_name
+from services.message_archive import message_archiver
+
+IDLE_HIBERNATE_ENABLED = os.getenv("IDLE_HIBERNATE_ENABLED", "false").lower() == "true"
+IDLE_HIBERNATE_AFTER_MINUTES = float(os.getenv("IDLE_HIBERNATE_AFTER_MINUTES", 24 * 60))
+IDLE_CHECK_INTERVAL_SECONDS = float(os.getenv("IDLE_CHECK_INTERVAL_SECONDS", 300))
+IDLE_ACTIVITY_FLUSH_SECONDS = float(os.getenv("IDLE_ACTIVITY_FLUSH_SECONDS", 60))
+IDLE_MAX_QUEUED_SENDS = int(os.getenv("IDLE_MAX_QUEUED_SENDS", 100)) # Envíos en espera por instancia dormida
+WAKE_TIMEOUT_SECONDS = int(os.getenv("WAKE_TIMEOUT_SECONDS", 120))
+# Una reserva (hibernando/despertando) más antigua que esto se da por abandonada (p. ej. el worker murió)
+IDLE_TRANSITION_STALE_SECONDS = float(os.getenv("IDLE_TRANSITION_STALE_SECONDS", 3 * WAKE_TIMEOUT_SECONDS))
+WAKE_POLL_SECONDS = 2
+
+class _QueuedSend(NamedTuple):
+    send: Callable[..., Awaitable]
+    instance_id: int
+    phone_number: str
+    message: str
+    ghl_message_id: str | None
+
+class IdleManager:
+    """
+    Hiberna los contenedores dedicados sin tráfico y los despierta al enviar.
+    - La actividad (webhooks y envíos) se apunta en memoria y se vuelca por lotes a
+      Instance.last_activity_at, para que todos los workers decidan con el mismo dato.
+    - Hibernar es detener el contenedor: las sesiones viven en su volumen '<nombre>_sessions'.
+    - Los envíos a una instancia dormida se encolan en memoria y salen en cuanto despierta.
+    - Antes de detener o arrancar un contenedor, el worker reserva la instancia con un UPDATE
+      corto (is_hibernating / is_waking); el trabajo con Docker se hace sin transacción abierta,
+      así nunca hay filas bloqueadas mientras se espera a Docker o a WAHA.
+    Las instancias de contenedores compartidos no se hibernan (el contenedor es de varios tenants),
+    ni los contenedores sin la etiqueta WAHA_LABEL: son anteriores al volumen de sesiones y a
+    WHATSAPP_RESTART_ALL_SESSIONS, y al volver a arrancarlos su sesión no se iniciaría sola.
+    """
+    def __init__(self):
+        self._activity: dict[str, datetime] = {}
+        self._queues: dict[str, list] = {}
+        self._waking: dict[str, asyncio.Task] = {}
+        self._not_hibernatable: set[str] = set() # Contenedores sin WAHA_LABEL ya comprobados
+        self._tasks = []
+
+    def touch(self, instance_name: str):
+        self._activity[instance_name] = datetime.now(timezone.utc)
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._run_activity_flush())]
+            if IDLE_HIBERNATE_ENABLED:
+                self._tasks.append(asyncio.create_task(self._run_sweep()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        await self._flush_activity()
+
+    # --- Actividad ---
+
+    async def _run_activity_flush(self):
+        while True:
+            await asyncio.sleep(IDLE_ACTIVITY_FLUSH_SECONDS)
+            try:
+                await self._flush_activity()
+            except Exception as e:
+                logger.error(f"Error al volcar la actividad de las instancias: {e}", exc_info=True)
+
+    async def _flush_activity(self):
+        if not self._activity:
+            return
+        batch, self._activity = self._activity, {}
+        try:
+            await asyncio.to_thread(self._write_activity, batch)
+        except Exception:
+            # Se devuelve el lote para el siguiente volcado, sin pisar actividad más reciente
+            for name, seen_at in batch.items():
+                if name not in self._activity or self._activity[name] < seen_at:
+                    self._activity[name] = seen_at
+            raise
+
+    def _write_activity(self, batch: dict[str, datetime]):
+        db = SessionLocal()
+        try:
+            # Un único UPDATE por lotes (executemany)
+            stmt = (
+                update(InstanceModel.__table__)
+                .where(InstanceModel.__table__.c.instance_name == bindparam("name"))
+                .where(func.coalesce(InstanceModel.__table__.c.last_activity_at, bindparam("seen_at")) <= bindparam("seen_at"))
+                .values(last_activity_at=bindparam("seen_at"))
+            )
+            db.execute(stmt, [{"name": name, "seen_at": seen_at} for name, seen_at in batch.items()])
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    # --- Hibernación ---
+
+    async def _run_sweep(self):
+        while True:
+            await asyncio.sleep(IDLE_CHECK_INTERVAL_SECONDS)
+            try:
+                await asyncio.to_thread(self._sweep)
+            except Exception as e:
+                logger.error(f"Error al buscar instancias inactivas: {e}", exc_info=True)
+
+    def _sweep(self):
+        now = datetime.now(timezone.utc)
+        cutoff = now - timedelta(minutes=IDLE_HIBERNATE_AFTER_MINUTES)
+        db = SessionLocal()
+        try:
+            # Las instancias sin actividad registrada empiezan a contar desde ahora
+            db.query(InstanceModel).filter(InstanceModel.last_activity_at.is_(None)).update({"last_activity_at": now}, synchronize_session=False)
+            db.commit()
+
+            shared_names = db.query(WahaContainer.container_name)
+            idle_ids = [
+                instance_id for instance_id, instance_name in
+                db.query(InstanceModel.id, InstanceModel.instance_name)
+                .filter(InstanceModel.is_hibernated.is_(False), InstanceModel.last_activity_at < cutoff)
+                .filter(InstanceModel.container_name.isnot(None), InstanceModel.container_name.not_in(shared_names))
+                .all()
+                if instance_name not in self._activity and instance_name not in self._waking and instance_name not in self._not_hibernatable
+            ]
+            if not idle_ids:
+                return
+
+            # Reserva atómica: si otro worker está en el mismo barrido, cada instancia la gana uno solo
+            claimed = db.execute(
+                update(InstanceModel)
+                .where(InstanceModel.id.in_(idle_ids), InstanceModel.is_hibernated.is_(False), InstanceModel.last_activity_at < cutoff)
+                .where(_unclaimed(now))
+                .values(is_hibernating=True, transition_started_at=now)
+                .returning(InstanceModel.id, InstanceModel.instance_name, InstanceModel.ghl_location_id, InstanceModel.docker_host, InstanceModel.container_name)
+                .execution_options(synchronize_session=False)
+            ).all()
+            for row in claimed:
+                invalidate_instance(db, row) # Los envíos que lleguen mientras se detiene se encolan
+            db.commit()
+
+            # El contenedor se detiene fuera de cualquier transacción
+            for row in claimed:
+                self._hibernate(db, row)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _hibernate(self, db, row):
+        hibernated = False
+        try:
+            container = scheduler.get_host(row.docker_host).client.containers.get(row.container_name)
+            if WAHA_LABEL not in (container.labels or {}):
+                self._not_hibernatable.add(row.instance_name)
+                logger.info(f"La instancia '{row.instance_name}' no se hiberna: su contenedor es anterior a la hibernación.")
+            else:
+                container.stop(timeout=10)
+                hibernated = True
+                logger.info(f"Instancia '{row.instance_name}' hibernada tras {IDLE_HIBERNATE_AFTER_MINUTES:.0f} min sin actividad.")
+        except Exception as e:
+            logger.error(f"No se pudo hibernar la instancia '{row.instance_name}': {e}", exc_info=True)
+        try:
+            db.execute(
+                update(InstanceModel).where(InstanceModel.id == row.id)
+                .values(is_hibernated=hibernated, is_hibernating=False, transition_started_at=None)
+                .execution_options(synchronize_session=False)
+            )
+            invalidate_instance(db, row)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"No se pudo guardar el estado de hibernación de '{row.instance_name}': {e}", exc_info=True)
+
+    # --- Despertar ---
+
+    def queue_send(self, instance, send, phone_number: str, message: str, ghl_message_id: str | None = None) -> bool:
+        """
+        Encola un envío para una instancia hibernada y la despierta si no lo está ya haciendo.
+        'send' es una corrutina que recibe la instancia despierta. El resto de datos sirven para
+        archivar el envío como fallido si la instancia no despierta. Devuelve False si la cola está llena.
+        """
+        queue = self._queues.setdefault(instance.instance_name, [])
+        if len(queue) >= IDLE_MAX_QUEUED_SENDS:
+            return False
+        queue.append(_QueuedSend(send, instance.id, phone_number, message, ghl_message_id))
+        if instance.instance_name not in self._waking:
+            self._waking[instance.instance_name] = asyncio.create_task(self._wake_and_drain(instance.instance_name))
+        return True
+
+    async def _wake_and_drain(self, instance_name: str):
+        try:
+            await asyncio.to_thread(self._wake, instance_name)
+            db = SessionLocal()
+            try:
+                awake_instance = get_instance_by_name(db, instance_name)
+            finally:
+                db.close()
+            logger.info(f"Instancia '{instance_name}' despierta. Enviando los mensajes en espera...")
+            # Lo que llegue mientras se vacía la cola también sale en este mismo turno
+            while self._queues.get(instance_name):
+                for queued in self._queues.pop(instance_name):
+                    try:
+                        await queued.send(awake_instance)
+                    except Exception as e:
+                        logger.error(f"Fallo al enviar un mensaje en espera de '{instance_name}': {e}", exc_info=True)
+        except Exception as e:
+            dropped = self._queues.pop(instance_name, [])
+            logger.error(f"No se pudo despertar la instancia '{instance_name}'. Se descartan {len(dropped)} envíos: {e}", exc_info=True)
+            # GHL ya recibió "queued": se archivan como fallidos para poder reenviarlos desde el archivo
+            for queued in dropped:
+                message_archiver.record(
+                    queued.instance_id, queued.phone_number, "outbound", "failed",
+                    body=queued.message, source="ghl", ghl_message_id=queued.ghl_message_id
+                )
+        finally:
+            self._waking.pop(instance_name, None)
+
+    def _wake(self, instance_name: str):
+        """
+        Despierta la instancia. Si otro worker la está despertando (o durmiendo), espera a que
+        termine y vuelve a comprobar; la fila solo se toca en transacciones cortas.
+        """
+        db = SessionLocal()
+        try:
+            deadline = time.monotonic() + 2 * WAKE_TIMEOUT_SECONDS
+            while True:
+                claimed = self._claim_wake(db, instance_name)
+                if claimed:
+                    break
+                state = db.query(InstanceModel.is_hibernated, InstanceModel.is_hibernating).filter(InstanceModel.instance_name == instance_name).one()
+                db.commit()
+                if not state.is_hibernated and not state.is_hibernating:
+                    return # Otro worker la despertó mientras esperábamos
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"La instancia '{instance_name}' sigue reservada por otro worker.")
+                time.sleep(WAKE_POLL_SECONDS)
+
+            try:
+                instance_url = self._start_container(claimed)
+            except Exception:
+                db.execute(update(InstanceModel).where(InstanceModel.id == claimed.id).values(is_waking=False, transition_started_at=None).execution_options(synchronize_session=False))
+                db.commit()
+                raise
+
+            db.execute(
+                update(InstanceModel).where(InstanceModel.id == claimed.id)
+                .values(
+                    instance_url=instance_url, is_hibernated=False, is_waking=False, transition_started_at=None,
+                    last_activity_at=datetime.now(timezone.utc), webhook_config_version=WEBHOOK_CONFIG_VERSION
+                )
+                .execution_options(synchronize_session=False)
+            )
+            invalidate_instance(db, claimed)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _claim_wake(self, db, instance_name: str):
+        now = datetime.now(timezone.utc)
+        claimed = db.execute(
+            update(InstanceModel)
+            .where(InstanceModel.instance_name == instance_name, InstanceModel.is_hibernated.is_(True))
+            .where(_unclaimed(now))
+            .values(is_waking=True, transition_started_at=now)
+            .returning(
+                InstanceModel.id, InstanceModel.instance_name, InstanceModel.ghl_location_id, InstanceModel.docker_host,
+                InstanceModel.container_name, InstanceModel.api_key, InstanceModel.session_name
+            )
+            .execution_options(synchronize_session=False)
+        ).first()
+        db.commit()
+        return claimed
+
+    def _start_container(self, instance) -> str:
+        """Arranca el contenedor y espera a que la sesión funcione. Devuelve la URL pública nueva."""
+        host = scheduler.get_host(instance.docker_host)
+        container = host.client.containers.get(instance.container_name)
+        logger.info(f"Despertando la instancia '{instance.instance_name}'...")
+        container.start()
+
+        # El puerto publicado cambia al volver a arrancar
+        port = published_port(container)
+        internal_url = host.internal_url(port)
+        session_name = instance.session_name or "default"
+        wait_for_instance_ready(internal_url, instance.api_key, timeout=WAKE_TIMEOUT_SECONDS)
+        configure_waha_session(internal_url, instance.api_key, webhook_url_for(instance.instance_name), session_name=session_name)
+        wait_for_session_working(internal_url, instance.api_key, session_name, timeout=WAKE_TIMEOUT_SECONDS)
+        return host.public_url(port)
+
+def _unclaimed(now: datetime):
+    # Sin reserva en curso, o con una reserva abandonada
+    stale = now - timedelta(seconds=IDLE_TRANSITION_STALE_SECONDS)
+    return or_(
+        InstanceModel.transition_started_at.is_(None),
+        InstanceModel.transition_started_at < stale,
+        (InstanceModel.is_hibernating.is_(False)) & (InstanceModel.is_waking.is_(False)),
+    )
+
+idle_manager = IdleManager()
@@ -0,0 +1,53 @@
+# services/instance_cache.py
+from types import SimpleNamespace
+from sqlalchemy.orm import Session
+
+from models.instance import Instance as InstanceModel
+from models.waha_container import WahaContainer
+from services.cache import LocalCache
+from services import invalidation_bus
+
+# Copias de solo lectura de las instancias (incluidos sus tokens de GHL) para el camino de los mensajes.
+# Se guardan como SimpleNamespace y no como objetos de SQLAlchemy, que están atados a una sesión.
+instances_by_name = LocalCache("instance")
+instances_by_location = LocalCache("instance_location")
+
+def _snapshot(db: Session, instance: InstanceModel) -> SimpleNamespace:
+    snapshot = SimpleNamespace(**{column.name: getattr(instance, column.name) for column in InstanceModel.__table__.columns})
+    # Clave con la que el servidor habla con WAHA: la del contenedor compartido si la instancia vive en uno
+    snapshot.waha_api_key = instance.api_key
+    if instance.is_shared:
+        snapshot.waha_api_key = db.query(WahaContainer.api_key).filter(WahaContainer.container_name == instance.container_name).scalar()
+    return snapshot
+
+def get_instance_by_name(db: Session, instance_name: str):
+    cached = instances_by_name.get(instance_name)
+    if cached is None:
+        generation = instances_by_name.generation(instance_name)
+        instance = db.query(InstanceModel).filter(InstanceModel.instance_name == instance_name).first()
+        if instance is None:
+            return None
+        cached = _snapshot(db, instance)
+        instances_by_name.set(instance_name, cached, generation)
+    return cached
+
+def get_instance_by_location(db: Session, location_id: str):
+    cached = instances_by_location.get(location_id)
+    if cached is None:
+        generation = instances_by_location.generation(location_id)
+        instance = db.query(InstanceModel).filter(InstanceModel.ghl_location_id == location_id).first()
+        if instance is None:
+            return None
+        cached = _snapshot(db, instance)
+        instances_by_location.set(location_id, cached, generation)
+    return cached
+
+def invalidate_instance(db: Session, instance: InstanceModel, old_location_id: str | None = None):
+    """
+    Anuncia a todos los workers que la instancia ha cambiado. Llamar antes del commit
+    de la escritura; 'old_location_id' cubre el caso de que cambie la location de GHL.
+    """
+    invalidation_bus.publish(db, "instance", instance.instance_name)
+    invalidation_bus.publish(db, "instance_location", instance.ghl_location_id)
+    if old_location_id and old_location_id != instance.ghl_location_id:
+        invalidation_bus.publish(db, "instance_location", old_location_id)
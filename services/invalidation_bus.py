@@ -0,0 +1,119 @@
+# services/invalidation_bus.py
+import os
+import asyncio
+from typing import Callable
+import psycopg2
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from logger_config import logger
+from database.connection import engine
+from services.cache import CACHES, clear_all
+
+# Canal de Postgres por el que viajan las claves modificadas ("espacio:clave")
+CHANNEL = "cache_invalidation"
+# Cada cuánto se comprueba que la conexión LISTEN sigue viva
+LISTEN_PING_SECONDS = float(os.getenv("CACHE_LISTEN_PING_SECONDS", 30))
+LISTEN_RECONNECT_SECONDS = float(os.getenv("CACHE_LISTEN_RECONNECT_SECONDS", 5))
+
+# Espacios que no son cachés: su aviso se entrega a una función (p. ej. configuración en caliente)
+_handlers: dict[str, Callable[[str], None]] = {}
+
+def subscribe(namespace: str, handler: Callable[[str], None]):
+    """Registra una función que recibe el contenido de cada aviso del espacio, en todos los procesos."""
+    _handlers[namespace] = handler
+
+def publish(db: Session, namespace: str, key):
+    """
+    Anuncia que una clave ha cambiado. Se llama dentro de la transacción de escritura:
+    Postgres entrega el NOTIFY al hacer commit (y lo descarta si hay rollback).
+    La copia local se elimina ya, sin esperar al aviso.
+    """
+    if key is None:
+        return
+    _dispatch(namespace, str(key))
+    db.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": CHANNEL, "payload": f"{namespace}:{key}"})
+
+def _dispatch(namespace: str, key: str):
+    handler = _handlers.get(namespace)
+    if handler:
+        try:
+            handler(key)
+        except Exception as e:
+            logger.error(f"Error al aplicar el aviso '{namespace}': {e}", exc_info=True)
+        return
+    cache = CACHES.get(namespace)
+    if cache:
+        cache.evict(key)
+
+def _ping(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT 1")
+
+class InvalidationListener:
+    """
+    Mantiene una conexión LISTEN por proceso y elimina de las cachés locales las claves
+    anunciadas. Si la conexión cae, vacía todas las cachés (pudo perder avisos) y reconecta.
+    """
+    def __init__(self):
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self._listen()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Conexión LISTEN de invalidación de caché perdida: {e}. Reconectando...")
+            clear_all()
+            await asyncio.sleep(LISTEN_RECONNECT_SECONDS)
+
+    async def _listen(self):
+        loop = asyncio.get_running_loop()
+        dsn = engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+        conn = await asyncio.to_thread(psycopg2.connect, dsn, keepalives=1, keepalives_idle=30)
+        conn.autocommit = True
+        failed = loop.create_future()
+
+        def on_readable():
+            try:
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    namespace, _, key = notify.payload.partition(":")
+                    _dispatch(namespace, key)
+            except Exception as e:
+                if not failed.done():
+                    failed.set_exception(e)
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(f"LISTEN {CHANNEL}")
+            # Lo cacheado antes de escuchar pudo quedar obsoleto sin aviso: se resincroniza
+            clear_all()
+            loop.add_reader(conn.fileno(), on_readable)
+            logger.info(f"Escuchando invalidaciones de caché en el canal '{CHANNEL}'.")
+            while True:
+                try:
+                    await asyncio.wait_for(asyncio.shield(failed), timeout=LISTEN_PING_SECONDS)
+                except asyncio.TimeoutError:
+                    await asyncio.to_thread(_ping, conn)
+                    on_readable() # el ping puede haber recibido avisos
+        finally:
+            try:
+                loop.remove_reader(conn.fileno())
+            except Exception:
+                pass
+            conn.close()
+
+invalidation_listener = InvalidationListener()
@@ -0,0 +1,153 @@
+# services/message_archive.py
+import os
+import re
+import asyncio
+from datetime import date, datetime, timezone
+from sqlalchemy import insert, text
+
+from logger_config import logger
+from database.connection import SessionLocal
+from models.message_archive import MessageArchive
+
+ARCHIVE_FLUSH_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_FLUSH_INTERVAL_SECONDS", 5))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", 500)) # Vuelca antes si se llena el lote
+ARCHIVE_MAX_BUFFERED = int(os.getenv("ARCHIVE_MAX_BUFFERED", 20000))
+ARCHIVE_RETENTION_MONTHS = int(os.getenv("ARCHIVE_RETENTION_MONTHS", 6))
+ARCHIVE_PARTITIONS_AHEAD = int(os.getenv("ARCHIVE_PARTITIONS_AHEAD", 2))
+ARCHIVE_MAINTENANCE_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_MAINTENANCE_INTERVAL_SECONDS", 6 * 3600))
+
+TABLE = MessageArchive.__tablename__
+PARTITION_NAME = re.compile(rf"^{TABLE}_(\d{{4}})_(\d{{2}})$")
+
+def _add_months(day: date, months: int) -> date:
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def ensure_partitions(db, today: date | None = None):
+    """Crea la partición del mes actual y las ARCHIVE_PARTITIONS_AHEAD siguientes."""
+    month = (today or datetime.now(timezone.utc).date()).replace(day=1)
+    for offset in range(ARCHIVE_PARTITIONS_AHEAD + 1):
+        start = _add_months(month, offset)
+        end = _add_months(start, 1)
+        db.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {TABLE}_{start:%Y_%m} PARTITION OF {TABLE} "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        ))
+    db.commit()
+
+def drop_expired_partitions(db, today: date | None = None) -> list[str]:
+    """Elimina las particiones cuyo mes completo es anterior a la retención."""
+    cutoff = _add_months((today or datetime.now(timezone.utc).date()).replace(day=1), -ARCHIVE_RETENTION_MONTHS)
+    partitions = db.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON pg_inherits.inhparent = parent.oid "
+        "JOIN pg_class child ON pg_inherits.inhrelid = child.oid "
+        "WHERE parent.relname = :table"
+    ), {"table": TABLE}).scalars().all()
+
+    dropped = []
+    for name in partitions:
+        match = PARTITION_NAME.match(name)
+        if match and date(int(match.group(1)), int(match.group(2)), 1) < cutoff:
+            db.execute(text(f"DROP TABLE IF EXISTS {name}"))
+            dropped.append(name)
+    db.commit()
+    if dropped:
+        logger.info(f"Archivo de mensajes: particiones caducadas eliminadas: {', '.join(dropped)}")
+    return dropped
+
+class MessageArchiver:
+    """
+    Acumula en memoria las filas del archivo y las inserta por lotes (un INSERT múltiple
+    por volcado), cada intervalo o en cuanto se llena un lote. También mantiene las particiones.
+    """
+    def __init__(self):
+        self._buffer: list[dict] = []
+        self._full = asyncio.Event()
+        self._tasks = []
+
+    def record(self, instance_id: int, phone: str, direction: str, status: str, latency_ms: int | None = None,
+               wa_message_id: str | None = None, ghl_contact_id: str | None = None,
+               ghl_conversation_id: str | None = None, body: str | None = None,
+               source: str = "waha", ghl_message_id: str | None = None):
+        if len(self._buffer) >= ARCHIVE_MAX_BUFFERED:
+            logger.warning("Archivo de mensajes saturado: se descarta la fila más antigua.")
+            self._buffer.pop(0)
+        self._buffer.append({
+            "created_at": datetime.now(timezone.utc),
+            "instance_id": instance_id,
+            "phone": phone,
+            "direction": direction,
+            "source": source,
+            "status": status,
+            "latency_ms": latency_ms,
+            "wa_message_id": wa_message_id,
+            "ghl_contact_id": ghl_contact_id,
+            "ghl_conversation_id": ghl_conversation_id,
+            "ghl_message_id": ghl_message_id,
+            # Solo los fallidos guardan el cuerpo, para poder reenviarlos
+            "body": body if status == "failed" else None,
+        })
+        if len(self._buffer) >= ARCHIVE_BATCH_SIZE:
+            self._full.set()
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._run_flush()), asyncio.create_task(self._run_maintenance())]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        await self.flush()
+
+    async def _run_flush(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=ARCHIVE_FLUSH_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error al volcar el archivo de mensajes: {e}", exc_info=True)
+
+    async def _run_maintenance(self):
+        while True:
+            try:
+                await asyncio.to_thread(self._maintain)
+            except Exception as e:
+                logger.error(f"Error en el mantenimiento de particiones del archivo: {e}", exc_info=True)
+            await asyncio.sleep(ARCHIVE_MAINTENANCE_INTERVAL_SECONDS)
+
+    def _maintain(self):
+        db = SessionLocal()
+        try:
+            ensure_partitions(db)
+            drop_expired_partitions(db)
+        finally:
+            db.close()
+
+    async def flush(self):
+        while self._buffer:
+            batch, self._buffer = self._buffer[:ARCHIVE_BATCH_SIZE], self._buffer[ARCHIVE_BATCH_SIZE:]
+            try:
+                await asyncio.to_thread(self._write, batch)
+            except Exception:
+                # Se conservan para el siguiente volcado (p. ej. si faltaba la partición)
+                self._buffer[:0] = batch
+                raise
+
+    def _write(self, batch: list[dict]):
+        db = SessionLocal()
+        try:
+            db.execute(insert(MessageArchive), batch)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+message_archiver = MessageArchiver()
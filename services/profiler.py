@@ -0,0 +1,175 @@
+# services/profiler.py
+import os
+import re
+import json
+import sys
+import time
+import random
+import threading
+from collections import Counter
+
+from logger_config import logger
+from services import invalidation_bus
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", 50))
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", 5))
+
+class ProfilingSettings:
+    """
+    Qué peticiones se perfilan. Se cambia en caliente desde /api/admin/profiling, que la
+    difunde a todos los workers por el canal de avisos de Postgres (espacio 'profiling').
+    No se persiste: un worker que arranque después empieza con el perfilado desactivado.
+    El filtro por tenant compara con los segmentos de la ruta, así que solo sirve para rutas
+    que llevan el nombre de la instancia (p. ej. /api/webhooks/waha/{instance_name});
+    /api/ghl-actions/send-message lleva el tenant en el cuerpo ('locationId') y no se filtra
+    por tenant: para perfilarla hay que filtrar por ruta y muestreo.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.routes: list[str] = []  # Prefijos de ruta, p. ej. "/api/webhooks/waha"
+        self.tenants: set[str] = set()  # Nombres de instancia presentes en la ruta (no el cuerpo)
+        self.sample_rate = 1.0
+
+    def update(self, enabled: bool, routes: list[str], tenants: list[str], sample_rate: float):
+        self.enabled = enabled
+        self.routes = list(routes)
+        self.tenants = set(tenants)
+        self.sample_rate = sample_rate
+
+    def as_dict(self) -> dict:
+        return {"enabled": self.enabled, "routes": self.routes, "tenants": sorted(self.tenants), "sample_rate": self.sample_rate}
+
+    def matches(self, path: str) -> bool:
+        if self.routes and not any(path.startswith(route) for route in self.routes):
+            return False
+        if self.tenants and not self.tenants.intersection(path.split("/")):
+            return False
+        return random.random() < self.sample_rate
+
+def _is_idle(frame) -> bool:
+    # Hilos del threadpool esperando trabajo (bloqueados en threading.Condition.wait)
+    return frame.f_code.co_name == "wait" and frame.f_code.co_filename.endswith("threading.py")
+
+class StackSampler:
+    """
+    Muestrea desde un hilo aparte las pilas de todos los hilos del proceso (el event loop y el
+    threadpool donde corren los endpoints y tareas síncronas) y las acumula en formato 'collapsed'
+    (una línea 'hilo;f1;f2 N' por pila), listo para flamegraph.pl o speedscope.
+    Los hilos ociosos se descartan. Al muestrear el proceso completo también se recoge
+    lo que hagan en ese momento otras peticiones.
+    """
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or _is_idle(frame):
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+class ProfileStore:
+    """Perfiles en disco, acotados a los PROFILE_MAX_FILES más recientes."""
+    NAME_PATTERN = re.compile(r"^[\w.-]+\.collapsed$")
+
+    def __init__(self, directory: str = PROFILE_DIR, max_files: int = PROFILE_MAX_FILES):
+        self.directory = directory
+        self.max_files = max_files
+
+    def save(self, method: str, path: str, duration_ms: float, samples: Counter):
+        os.makedirs(self.directory, exist_ok=True)
+        slug = re.sub(r"[^\w-]+", "_", path.strip("/"))[:80]
+        name = f"{time.strftime('%Y%m%dT%H%M%S')}_{int(duration_ms)}ms_{method}_{slug}.collapsed"
+        with open(os.path.join(self.directory, name), "w") as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+        self._trim()
+        logger.info(f"Perfil guardado: {name} ({sum(samples.values())} muestras)")
+
+    def _trim(self):
+        files = sorted(self.list(), key=lambda p: p["modified"])
+        for profile in files[:max(0, len(files) - self.max_files)]:
+            os.remove(os.path.join(self.directory, profile["name"]))
+
+    def list(self) -> list[dict]:
+        if not os.path.isdir(self.directory):
+            return []
+        result = []
+        for name in os.listdir(self.directory):
+            if self.NAME_PATTERN.match(name):
+                stat = os.stat(os.path.join(self.directory, name))
+                result.append({"name": name, "size": stat.st_size, "modified": stat.st_mtime})
+        return sorted(result, key=lambda p: p["modified"], reverse=True)
+
+    def path_for(self, name: str) -> str | None:
+        """Ruta del perfil o None si el nombre no es válido o no existe (evita salir del directorio)."""
+        if not self.NAME_PATTERN.match(name):
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.isfile(path) else None
+
+profiling_settings = ProfilingSettings()
+profile_store = ProfileStore()
+
+PROFILING_NAMESPACE = "profiling"
+
+def publish_settings(db, settings: dict):
+    """Difunde la configuración a todos los workers (se aplica aquí mismo y en los demás al hacer commit)."""
+    invalidation_bus.publish(db, PROFILING_NAMESPACE, json.dumps(settings))
+
+def _apply_settings(payload: str):
+    settings = json.loads(payload)
+    profiling_settings.update(settings["enabled"], settings["routes"], settings["tenants"], settings["sample_rate"])
+    logger.info(f"Configuración de perfilado actualizada: {profiling_settings.as_dict()}")
+
+invalidation_bus.subscribe(PROFILING_NAMESPACE, _apply_settings)
+
+class ProfilingMiddleware:
+    """
+    Middleware ASGI que perfila la petición completa, incluidas sus BackgroundTasks
+    (Starlette las ejecuta dentro de la misma llamada, tras enviar la respuesta).
+    Con el perfilado desactivado solo cuesta comprobar un booleano.
+    Se perfila una petición a la vez; las que coinciden mientras tanto se atienden sin perfilar.
+    """
+    def __init__(self, app):
+        self.app = app
+        self._busy = threading.Lock()
+
+    async def __call__(self, scope, receive, send):
+        if not profiling_settings.enabled or scope["type"] != "http" or not profiling_settings.matches(scope["path"]):
+            return await self.app(scope, receive, send)
+        if not self._busy.acquire(blocking=False):
+            return await self.app(scope, receive, send)
+
+        sampler = StackSampler(PROFILE_SAMPLE_INTERVAL_MS / 1000)
+        start = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            sampler.stop()
+            self._busy.release()
+            duration_ms = (time.perf_counter() - start) * 1000
+            try:
+                profile_store.save(scope["method"], scope["path"], duration_ms, sampler.samples)
+            except Exception as e:
+                logger.error(f"No se pudo guardar el perfil de {scope['path']}: {e}", exc_info=True)
@@ -0,0 +1,64 @@
+# services/session_sync.py
+import threading
+from urllib.parse import urlsplit
+from sqlalchemy import text
+
+from logger_config import logger
+from database.connection import SessionLocal, engine
+from models.instance import Instance as InstanceModel
+from models.waha_container import WahaContainer
+from services.docker_scheduler import scheduler
+from services.docker_service import WEBHOOK_CONFIG_VERSION, configure_waha_session, webhook_url_for
+
+# Clave del bloqueo consultivo: con varios workers arrancando a la vez, solo uno reconfigura
+SESSION_SYNC_LOCK_KEY = 726105
+
+def _internal_access(db, instance: InstanceModel) -> tuple[str, str]:
+    """URL interna y clave con las que el backend configura la sesión de la instancia."""
+    if instance.is_shared:
+        pool_container = db.query(WahaContainer).filter(WahaContainer.container_name == instance.container_name).one()
+        return pool_container.internal_url, pool_container.api_key
+    port = urlsplit(instance.instance_url).port
+    return scheduler.get_host(instance.docker_host).internal_url(port), instance.api_key
+
+def resync_session_webhooks():
+    """
+    Vuelve a aplicar la configuración de webhook a las sesiones creadas con una versión
+    anterior (p. ej. sin suscripción a 'message.ack'). Cada sesión se reconfigura una sola vez:
+    al terminar se guarda la versión aplicada. Las hibernadas se configuran al despertar.
+    """
+    with engine.connect() as lock_conn:
+        if not lock_conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": SESSION_SYNC_LOCK_KEY}).scalar():
+            return # Otro worker ya lo está haciendo
+        db = SessionLocal()
+        try:
+            outdated = (
+                db.query(InstanceModel)
+                .filter(InstanceModel.webhook_config_version < WEBHOOK_CONFIG_VERSION, InstanceModel.is_hibernated.is_(False))
+                .all()
+            )
+            if outdated:
+                logger.info(f"Reconfigurando el webhook de {len(outdated)} sesiones de WAHA existentes...")
+            for instance in outdated:
+                try:
+                    instance_url, api_key = _internal_access(db, instance)
+                    configure_waha_session(instance_url, api_key, webhook_url_for(instance.instance_name), session_name=instance.session_name or "default")
+                    instance.webhook_config_version = WEBHOOK_CONFIG_VERSION
+                    db.commit()
+                except Exception as e:
+                    db.rollback()
+                    logger.error(f"No se pudo reconfigurar la sesión de '{instance.instance_name}': {e}")
+        finally:
+            db.close()
+            lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": SESSION_SYNC_LOCK_KEY})
+            lock_conn.commit()
+
+def _run():
+    try:
+        resync_session_webhooks()
+    except Exception as e:
+        logger.error(f"Error al reconfigurar las sesiones de WAHA existentes: {e}", exc_info=True)
+
+def start():
+    """Se lanza al arrancar, en un hilo aparte: cada sesión puede tardar varios segundos."""
+    threading.Thread(target=_run, name="session-sync", daemon=True).start()
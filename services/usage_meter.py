@@ -0,0 +1,132 @@
+# services/usage_meter.py
+import os
+import asyncio
+from datetime import date, datetime, timezone
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert
+
+from logger_config import logger
+from database.connection import SessionLocal
+from models.usage import UsageCounter
+
+USAGE_FLUSH_INTERVAL_SECONDS = float(os.getenv("USAGE_FLUSH_INTERVAL_SECONDS", 30))
+# Máximo de mensajes (entrantes + salientes) por instancia y día. 0 = sin límite.
+USAGE_DAILY_MESSAGE_QUOTA = int(os.getenv("USAGE_DAILY_MESSAGE_QUOTA", 0))
+
+METRICS = ("inbound_messages", "outbound_messages", "media_messages", "ghl_calls", "waha_calls")
+
+def _today() -> date:
+    return datetime.now(timezone.utc).date()
+
+def _empty() -> dict:
+    return {metric: 0 for metric in METRICS}
+
+class UsageMeter:
+    """
+    Contadores de uso en memoria por (instancia, día). Incrementar no toca la BD:
+    cada intervalo se vuelcan todos con un único UPSERT que suma a lo ya guardado.
+    """
+    def __init__(self, interval: float = USAGE_FLUSH_INTERVAL_SECONDS):
+        self.interval = interval
+        self._pending: dict[tuple[int, date], dict] = {}
+        # Totales de la BD tras el último volcado (de todos los procesos), para cuotas sin consultas
+        self._flushed: dict[tuple[int, date], dict] = {}
+        self._task = None
+
+    def increment(self, instance_id: int, metric: str, amount: int = 1):
+        if instance_id is None:
+            return
+        key = (instance_id, _today())
+        counters = self._pending.get(key)
+        if counters is None:
+            counters = self._pending[key] = _empty()
+        counters[metric] += amount
+
+    def current(self, instance_id: int) -> dict:
+        """Uso de hoy según lo último volcado más lo pendiente en este proceso. No consulta la BD."""
+        key = (instance_id, _today())
+        flushed = self._flushed.get(key, {})
+        pending = self._pending.get(key, {})
+        return {metric: flushed.get(metric, 0) + pending.get(metric, 0) for metric in METRICS}
+
+    def over_quota(self, instance_id: int) -> bool:
+        if not USAGE_DAILY_MESSAGE_QUOTA:
+            return False
+        usage = self.current(instance_id)
+        return usage["inbound_messages"] + usage["outbound_messages"] >= USAGE_DAILY_MESSAGE_QUOTA
+
+    def usage(self, db: Session, instance_id: int, since: date) -> list[dict]:
+        """Uso diario desde 'since', sumando lo que este proceso aún no ha volcado."""
+        rows = (
+            db.query(UsageCounter)
+            .filter(UsageCounter.instance_id == instance_id, UsageCounter.day >= since)
+            .order_by(UsageCounter.day)
+            .all()
+        )
+        days = {row.day: {metric: getattr(row, metric) for metric in METRICS} for row in rows}
+        for (pending_instance, day), counters in self._pending.items():
+            if pending_instance == instance_id and day >= since:
+                totals = days.setdefault(day, _empty())
+                for metric in METRICS:
+                    totals[metric] += counters[metric]
+        return [{"day": day.isoformat(), **totals} for day, totals in sorted(days.items())]
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error al volcar los contadores de uso: {e}", exc_info=True)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    async def flush(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        try:
+            # El UPSERT es síncrono: se ejecuta fuera del event loop
+            result = await asyncio.to_thread(self._write, batch)
+        except Exception:
+            # No perdemos el uso: se devuelve a lo pendiente para el siguiente volcado
+            for key, counters in batch.items():
+                pending = self._pending.setdefault(key, _empty())
+                for metric in METRICS:
+                    pending[metric] += counters[metric]
+            raise
+
+        today = _today()
+        self._flushed = {key: totals for key, totals in self._flushed.items() if key[1] == today}
+        for row in result:
+            self._flushed[(row.instance_id, row.day)] = {metric: getattr(row, metric) for metric in METRICS}
+        logger.info(f"Contadores de uso volcados: {len(batch)} filas.")
+
+    def _write(self, batch: dict):
+        rows = [{"instance_id": instance_id, "day": day, **counters} for (instance_id, day), counters in batch.items()]
+        stmt = insert(UsageCounter).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            constraint="uq_usage_instance_day",
+            set_={metric: getattr(UsageCounter, metric) + getattr(stmt.excluded, metric) for metric in METRICS},
+        ).returning(UsageCounter.instance_id, UsageCounter.day, *(getattr(UsageCounter, metric) for metric in METRICS))
+
+        db = SessionLocal()
+        try:
+            result = db.execute(stmt).all()
+            db.commit()
+            return result
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+usage_meter = UsageMeter()
@@ -0,0 +1,97 @@
+# services/waha_pool.py
+import os
+import secrets
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from logger_config import logger
+from models.instance import Instance as InstanceModel
+from models.waha_container import WahaContainer
+from services.docker_service import start_waha_container, wait_for_instance_ready, discard_container
+from services.docker_scheduler import scheduler
+
+# --- Modo compartido ---
+# En lugar de un contenedor por tenant, varios tenants comparten contenedores
+# multi-sesión de WAHA (requiere una imagen con soporte multi-sesión, p. ej. WAHA Plus).
+SHARED_MODE = os.getenv("WAHA_SHARED_MODE", "false").lower() == "true"
+SHARED_IMAGE = os.getenv("WAHA_SHARED_IMAGE", "devlikeapro/waha-plus:latest")
+SESSIONS_PER_CONTAINER = int(os.getenv("WAHA_SESSIONS_PER_CONTAINER", 50))
+
+def _find_container_with_room(db: Session, exclude: set[int]):
+    """
+    Devuelve el contenedor compartido con más sesiones que aún tenga hueco,
+    para llenar los contenedores existentes antes de arrancar uno nuevo.
+    """
+    sessions = func.count(InstanceModel.id)
+    row = (
+        db.query(WahaContainer, sessions)
+        .outerjoin(InstanceModel, InstanceModel.container_name == WahaContainer.container_name)
+        .filter(WahaContainer.id.not_in(list(exclude)))
+        .group_by(WahaContainer.id)
+        .having(sessions < WahaContainer.max_sessions)
+        .order_by(sessions.desc())
+        .first()
+    )
+    return row[0] if row else None
+
+def _lock_if_room(db: Session, candidate: WahaContainer):
+    """
+    Bloquea la fila del contenedor (FOR UPDATE no admite GROUP BY, por eso va aparte)
+    y vuelve a contar sus sesiones: otra petición pudo llenarlo entre medias.
+    """
+    locked = db.query(WahaContainer).filter(WahaContainer.id == candidate.id).with_for_update().populate_existing().one()
+    used = db.query(func.count(InstanceModel.id)).filter(InstanceModel.container_name == locked.container_name).scalar()
+    if used < locked.max_sessions:
+        return locked
+    db.rollback() # Libera el bloqueo
+    return None
+
+def acquire_shared_container(db: Session) -> WahaContainer:
+    """
+    Reserva un contenedor compartido con capacidad libre o arranca uno nuevo.
+    Lo devuelve con su fila bloqueada: el llamante debe guardar la instancia y hacer
+    commit enseguida, así dos altas simultáneas no superan 'max_sessions'.
+    """
+    tried = set()
+    while True:
+        candidate = _find_container_with_room(db, tried)
+        if candidate is None:
+            break
+        tried.add(candidate.id)
+        pool_container = _lock_if_room(db, candidate)
+        if pool_container:
+            logger.info(f"Usando el contenedor compartido '{pool_container.container_name}'.")
+            return pool_container
+
+    container_name = f"wa_shared_{secrets.token_hex(4)}"
+    api_key = secrets.token_hex(16)
+    logger.info(f"No hay contenedores compartidos con hueco. Arrancando '{container_name}'...")
+
+    container = None
+    try:
+        host = scheduler.place()
+        container, port = start_waha_container(host.client, container_name, api_key, image=SHARED_IMAGE)
+        internal_url = host.internal_url(port)
+        wait_for_instance_ready(internal_url, api_key)
+    except Exception:
+        if container:
+            discard_container(container)
+        raise
+
+    pool_container = WahaContainer(
+        container_name=container_name,
+        instance_url=host.public_url(port),
+        internal_url=internal_url,
+        api_key=api_key,
+        max_sessions=SESSIONS_PER_CONTAINER,
+        docker_host=host.name,
+    )
+    # Se guarda ya: el contenedor existe aunque la sesión del tenant falle después.
+    db.add(pool_container)
+    db.commit()
+    db.refresh(pool_container)
+    # Otra alta simultánea pudo ocuparlo ya: se reserva igual que uno existente
+    locked = _lock_if_room(db, pool_container)
+    if locked is None:
+        return acquire_shared_container(db)
+    return locked
@@ -3,13 +3,29 @@ import httpx
 from logger_config import logger
 import json
 
-async def send_whatsapp_message(instance_url: str, api_key: str, to_number: str, message: str):
+def extract_message_id(message: dict):
+    """
+    Obtiene el ID de un mensaje de WAHA. Según el motor, 'id' es un texto,
+    un objeto con '_serialized' o viene en 'key.id'.
+    """
+    if not message:
+        return None
+    message_id = message.get("id")
+    if isinstance(message_id, dict):
+        return message_id.get("_serialized")
+    if message_id:
+        return message_id
+    return (message.get("key") or {}).get("id")
+
+async def send_whatsapp_message(instance_url: str, api_key: str, to_number: str, message: str, session: str = "default"):
     """
     Envía un mensaje de texto a un número de WhatsApp usando una instancia de WAHA.
+    En contenedores compartidos 'session' indica la sesión del tenant.
+    Devuelve la respuesta de WAHA (el mensaje enviado) o None si falla.
     """
     if not all([instance_url, api_key, to_number, message]):
         logger.error("Faltan datos para enviar el mensaje de WhatsApp desde WAHA.")
-        return False
+        return None
 
     # Aseguramos que el número tenga el formato correcto para WAHA
     if not to_number.endswith('@c.us'):
@@ -17,18 +33,50 @@ async def send_whatsapp_message(instance_url: str, api_key: str, to_number: str,
 
     url = f"{instance_url}/api/sendText"
     headers = {"X-Api-Key": api_key, "Content-Type": "application/json"}
-    payload = {"chatId": to_number, "text": message}
+    payload = {"session": session, "chatId": to_number, "text": message}
 
     try:
-        logger.info(f"WAHA API Call: Enviando mensaje a {to_number}")
+        logger.info(f"WAHA API Call: Enviando mensaje a {to_number} (sesión '{session}')")
         async with httpx.AsyncClient() as client:
             response = await client.post(url, headers=headers, json=payload)
             response.raise_for_status()
-            logger.info(f"WAHA API Response: Mensaje enviado a {to_number} exitosamente. Response: {json.dumps(response.json(), indent=2)}")
-            return True
+            sent_message = response.json()
+            logger.info(f"WAHA API Response: Mensaje enviado a {to_number} exitosamente. Response: {json.dumps(sent_message, indent=2)}")
+            return sent_message
     except httpx.HTTPStatusError as e:
         logger.error(f"Error HTTP al enviar mensaje con WAHA. Status: {e.response.status_code}, Response: {e.response.text}")
-        return False
+        return None
     except Exception as e:
         logger.error(f"Excepción inesperada en send_whatsapp_message: {e}", exc_info=True)
-        return False
\ No newline at end of file
+        return None
+
+async def get_session_status(instance_url: str, api_key: str, session: str = "default"):
+    """
+    Estado de una sesión de WAHA (STARTING, SCAN_QR_CODE, WORKING, FAILED...).
+    Devuelve la respuesta de WAHA o None si falla.
+    """
+    try:
+        async with httpx.AsyncClient(timeout=10) as client:
+            response = await client.get(f"{instance_url}/api/sessions/{session}", headers={"X-Api-Key": api_key})
+            response.raise_for_status()
+            return response.json()
+    except Exception as e:
+        logger.error(f"No se pudo obtener el estado de la sesión '{session}' en WAHA: {e}")
+        return None
+
+async def get_session_qr(instance_url: str, api_key: str, session: str = "default"):
+    """
+    Código QR (PNG) para vincular la sesión con WhatsApp. Solo existe mientras
+    la sesión está en SCAN_QR_CODE. Devuelve los bytes de la imagen o None si falla.
+    """
+    try:
+        async with httpx.AsyncClient(timeout=10) as client:
+            response = await client.get(
+                f"{instance_url}/api/{session}/auth/qr", params={"format": "image"},
+                headers={"X-Api-Key": api_key, "Accept": "image/png"}
+            )
+            response.raise_for_status()
+            return response.content
+    except Exception as e:
+        logger.error(f"No se pudo obtener el código QR de la sesión '{session}' en WAHA: {e}")
+        return None
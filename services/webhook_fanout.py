@@ -0,0 +1,194 @@
+# services/webhook_fanout.py
+import os
+import socket
+import asyncio
+import ipaddress
+from collections import deque
+from urllib.parse import urlsplit
+import httpx
+
+from logger_config import logger
+from database.connection import SessionLocal
+from models.instance import Instance as InstanceModel
+from services.instance_cache import invalidate_instance
+
+# Un lote sale al llegar a WEBHOOK_BATCH_SIZE eventos o WEBHOOK_BATCH_WAIT_SECONDS después del primero
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", 20))
+WEBHOOK_BATCH_WAIT_SECONDS = float(os.getenv("WEBHOOK_BATCH_WAIT_SECONDS", 1))
+WEBHOOK_MAX_CONCURRENCY = int(os.getenv("WEBHOOK_MAX_CONCURRENCY", 2)) # Lotes simultáneos por destino
+WEBHOOK_MAX_BUFFERED = int(os.getenv("WEBHOOK_MAX_BUFFERED", 1000)) # Eventos en espera por destino
+WEBHOOK_MAX_RETRIES = int(os.getenv("WEBHOOK_MAX_RETRIES", 3))
+WEBHOOK_RETRY_BACKOFF_SECONDS = float(os.getenv("WEBHOOK_RETRY_BACKOFF_SECONDS", 2))
+WEBHOOK_TIMEOUT_SECONDS = float(os.getenv("WEBHOOK_TIMEOUT_SECONDS", 10))
+# Lotes fallidos seguidos (tras agotar reintentos) antes de desactivar el webhook del tenant
+WEBHOOK_DISABLE_AFTER_FAILURES = int(os.getenv("WEBHOOK_DISABLE_AFTER_FAILURES", 5))
+
+def _is_public_ip(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return not (ip.is_private or ip.is_loopback or ip.is_link_local or ip.is_reserved or ip.is_multicast or ip.is_unspecified)
+
+def _public_addresses(infos) -> bool:
+    return bool(infos) and all(_is_public_ip(info[4][0]) for info in infos)
+
+def check_public_url(url: str):
+    """
+    Comprueba que el webhook apunte a una dirección pública: se rechazan hosts que resuelven a
+    redes privadas, loopback o link-local (p. ej. la API de metadatos o los contenedores de WAHA).
+    Lanza ValueError si no es así.
+    """
+    parts = urlsplit(url)
+    try:
+        infos = socket.getaddrinfo(parts.hostname, parts.port or (443 if parts.scheme == "https" else 80), proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError) as e:
+        raise ValueError(f"No se pudo resolver el host '{parts.hostname}': {e}")
+    if not _public_addresses(infos):
+        raise ValueError(f"El host '{parts.hostname}' resuelve a una dirección privada o reservada.")
+
+class _PublicOnlyTransport(httpx.AsyncHTTPTransport):
+    """
+    Resuelve el host una sola vez, comprueba que todas sus direcciones sean públicas y conecta
+    a la dirección ya comprobada, conservando la cabecera Host y el SNI del nombre original.
+    Así un DNS que cambie entre la comprobación y la conexión (DNS rebinding) no puede
+    desviar la entrega a la red interna.
+    """
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        port = request.url.port or (443 if request.url.scheme == "https" else 80)
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(host, port, proto=socket.IPPROTO_TCP)
+        except (socket.gaierror, UnicodeError) as e:
+            raise httpx.ConnectError(f"No se pudo resolver el host '{host}': {e}", request=request)
+        if not _public_addresses(infos):
+            raise httpx.ConnectError(f"El host '{host}' no resuelve a una dirección pública.", request=request)
+        request.url = request.url.copy_with(host=infos[0][4][0])
+        request.extensions = {**request.extensions, "sni_hostname": host}
+        return await super().handle_async_request(request)
+
+class _Destination:
+    def __init__(self, instance_id: int, instance_name: str, url: str):
+        self.instance_id = instance_id
+        self.instance_name = instance_name
+        self.url = url
+        self.buffer = deque(maxlen=WEBHOOK_MAX_BUFFERED)
+        self.inflight = 0
+        self.consecutive_failures = 0
+        self.timer = None
+        self.disabled = False
+        self.disable_persisted = False
+
+class WebhookFanout:
+    """
+    Reenvía los mensajes procesados al webhook_url de cada tenant (n8n, etc.).
+    publish() solo encola en memoria, así un destino lento nunca frena el espejo a GHL.
+    Por destino: lotes por tamaño o tiempo, concurrencia acotada, reintentos con backoff
+    y desactivación automática si sigue fallando. Si un destino no da abasto, se descartan
+    los eventos más antiguos.
+    """
+    def __init__(self):
+        self._destinations: dict[tuple[int, str], _Destination] = {}
+        self._tasks = set()
+        self._client = None
+
+    def publish(self, instance, event: dict):
+        if not instance.webhook_url or not instance.webhook_enabled:
+            return
+        key = (instance.id, instance.webhook_url)
+        destination = self._destinations.get(key)
+        if destination is None:
+            destination = self._destinations[key] = _Destination(instance.id, instance.instance_name, instance.webhook_url)
+        if destination.disabled:
+            if not destination.disable_persisted:
+                return
+            # Llegados aquí la instancia vuelve a tener el webhook activo: el tenant lo reactivó
+            destination.disabled = destination.disable_persisted = False
+            destination.consecutive_failures = 0
+
+        if len(destination.buffer) == destination.buffer.maxlen:
+            logger.warning(f"Webhook de '{destination.instance_name}' saturado: se descarta el evento más antiguo.")
+        destination.buffer.append(event)
+
+        if len(destination.buffer) >= WEBHOOK_BATCH_SIZE:
+            self._dispatch(destination)
+        elif destination.timer is None:
+            loop = asyncio.get_running_loop()
+            destination.timer = loop.call_later(WEBHOOK_BATCH_WAIT_SECONDS, self._dispatch, destination, True)
+
+    def _dispatch(self, destination: _Destination, due: bool = False):
+        """Saca lotes completos (o cualquiera si 'due') mientras haya concurrencia libre."""
+        if destination.timer is not None and (due or not destination.buffer):
+            destination.timer.cancel()
+            destination.timer = None
+        while destination.buffer and destination.inflight < WEBHOOK_MAX_CONCURRENCY and (due or len(destination.buffer) >= WEBHOOK_BATCH_SIZE):
+            batch = [destination.buffer.popleft() for _ in range(min(WEBHOOK_BATCH_SIZE, len(destination.buffer)))]
+            destination.inflight += 1
+            task = asyncio.create_task(self._deliver(destination, batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _deliver(self, destination: _Destination, batch: list):
+        try:
+            payload = {"instance": destination.instance_name, "events": batch}
+            for attempt in range(WEBHOOK_MAX_RETRIES + 1):
+                try:
+                    response = await self._get_client().post(destination.url, json=payload)
+                    response.raise_for_status()
+                    destination.consecutive_failures = 0
+                    return
+                except Exception as e:
+                    logger.warning(f"Fallo al entregar {len(batch)} eventos al webhook de '{destination.instance_name}' (intento {attempt + 1}): {e}")
+                    if attempt < WEBHOOK_MAX_RETRIES:
+                        await asyncio.sleep(WEBHOOK_RETRY_BACKOFF_SECONDS * 2 ** attempt)
+
+            destination.consecutive_failures += 1
+            logger.error(f"Se descartan {len(batch)} eventos del webhook de '{destination.instance_name}' tras {WEBHOOK_MAX_RETRIES + 1} intentos.")
+            if destination.consecutive_failures >= WEBHOOK_DISABLE_AFTER_FAILURES and not destination.disabled:
+                await self._disable(destination)
+        finally:
+            destination.inflight -= 1
+            # Lo que quedó en espera sale ya, sin esperar a completar otro lote
+            self._dispatch(destination, due=True)
+
+    async def _disable(self, destination: _Destination):
+        destination.disabled = True
+        destination.buffer.clear()
+        logger.error(f"Webhook de '{destination.instance_name}' desactivado tras {destination.consecutive_failures} lotes fallidos seguidos.")
+        if await asyncio.to_thread(self._persist_disabled, destination):
+            destination.disable_persisted = True
+        else:
+            # Sin guardar, nada lo reactivaría: se vuelve a intentar tras el siguiente lote fallido
+            destination.disabled = False
+
+    def _persist_disabled(self, destination: _Destination) -> bool:
+        db = SessionLocal()
+        try:
+            instance = db.get(InstanceModel, destination.instance_id)
+            if instance and instance.webhook_url == destination.url:
+                instance.webhook_enabled = False
+                invalidate_instance(db, instance)
+                db.commit()
+            return True
+        except Exception as e:
+            db.rollback()
+            logger.error(f"No se pudo desactivar el webhook de '{destination.instance_name}': {e}", exc_info=True)
+            return False
+        finally:
+            db.close()
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            # Sin proxies del entorno: la conexión debe ir a la dirección ya comprobada
+            self._client = httpx.AsyncClient(timeout=WEBHOOK_TIMEOUT_SECONDS, transport=_PublicOnlyTransport(), trust_env=False)
+        return self._client
+
+    async def stop(self, timeout: float = 5):
+        for destination in self._destinations.values():
+            self._dispatch(destination, due=True)
+        if self._tasks:
+            await asyncio.wait(self._tasks, timeout=timeout)
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+webhook_fanout = WebhookFanout()
@@ -0,0 +1,24 @@
+# tests/test_cache.py
+from services.cache import LocalCache
+
+def test_set_is_skipped_when_key_was_evicted_during_load():
+    cache = LocalCache("test_generation_evict")
+    generation = cache.generation("a")
+    cache.evict("a") # Llega el NOTIFY mientras se leía la fila antigua
+    cache.set("a", "stale", generation)
+    assert cache.get("a") is None
+
+def test_set_is_skipped_when_cache_was_cleared_during_load():
+    cache = LocalCache("test_generation_clear")
+    generation = cache.generation("a")
+    cache.clear()
+    cache.set("a", "stale", generation)
+    assert cache.get("a") is None
+
+def test_set_is_kept_when_nothing_changed():
+    cache = LocalCache("test_generation_ok")
+    cache.evict("a")
+    generation = cache.generation("a")
+    cache.set("a", "fresh", generation)
+    cache.evict("b") # Otras claves no afectan
+    assert cache.get("a") == "fresh"
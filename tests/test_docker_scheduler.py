@@ -0,0 +1,88 @@
+# tests/test_docker_scheduler.py
+import pytest
+
+from services.docker_scheduler import (
+    DockerHost, DockerScheduler, NoCapacityError,
+    MAX_CONTAINERS_PER_HOST, WAHA_CONTAINER_MEMORY_MB, WAHA_CONTAINER_CPUS,
+)
+
+MB = 1024 * 1024
+
+class FakeContainers:
+    def __init__(self, running: int):
+        self.running = running
+
+    def list(self, filters=None):
+        return [object()] * self.running
+
+class FakeDockerClient:
+    """Cliente de Docker falso: solo lo que consulta DockerHost.capacity()."""
+    def __init__(self, memory_mb: int, cpus: int, running: int = 0, fail: bool = False):
+        self.memory_mb = memory_mb
+        self.cpus = cpus
+        self.containers = FakeContainers(running)
+        self.fail = fail
+
+    def info(self):
+        if self.fail:
+            raise ConnectionError("daemon inaccesible")
+        return {"MemTotal": self.memory_mb * MB, "NCPU": self.cpus}
+
+def make_scheduler(clients: dict, strategy: str = "binpack", draining: set[str] = frozenset()):
+    hosts = [DockerHost(name, f"tcp://{name}:2375", name, client_factory=lambda host: clients[host.name]) for name in clients]
+    return DockerScheduler(hosts, strategy=strategy, draining_lookup=lambda: set(draining))
+
+def room_for(containers: int) -> FakeDockerClient:
+    """Nodo en el que caben exactamente 'containers' contenedores más (limitado por memoria)."""
+    return FakeDockerClient(memory_mb=containers * WAHA_CONTAINER_MEMORY_MB, cpus=64)
+
+def test_binpack_fills_the_fullest_host_with_room():
+    scheduler = make_scheduler({"big": room_for(10), "small": room_for(2)}, strategy="binpack")
+    assert scheduler.place().name == "small"
+
+def test_least_loaded_uses_the_host_with_most_room():
+    scheduler = make_scheduler({"big": room_for(10), "small": room_for(2)}, strategy="least_loaded")
+    assert scheduler.place().name == "big"
+
+def test_headroom_uses_the_scarcest_resource():
+    # Mucha memoria pero CPU solo para un contenedor: binpack lo prefiere frente a un nodo con hueco para 3
+    cpu_bound = FakeDockerClient(memory_mb=100 * WAHA_CONTAINER_MEMORY_MB, cpus=1)
+    cpu_bound_room = int(1 / WAHA_CONTAINER_CPUS)
+    assert cpu_bound_room < 100
+    scheduler = make_scheduler({"cpu_bound": cpu_bound, "roomy": room_for(cpu_bound_room + 1)}, strategy="binpack")
+    assert scheduler.place().name == "cpu_bound"
+
+def test_no_capacity_raises():
+    full = FakeDockerClient(memory_mb=WAHA_CONTAINER_MEMORY_MB - 1, cpus=64)
+    at_limit = FakeDockerClient(memory_mb=10_000 * WAHA_CONTAINER_MEMORY_MB, cpus=10_000, running=MAX_CONTAINERS_PER_HOST)
+    scheduler = make_scheduler({"full": full, "at_limit": at_limit})
+    with pytest.raises(NoCapacityError):
+        scheduler.place()
+
+def test_unreachable_host_is_skipped():
+    scheduler = make_scheduler({"down": FakeDockerClient(0, 0, fail=True), "up": room_for(1)})
+    assert scheduler.place().name == "up"
+    assert "error" in next(c for c in scheduler.capacities() if c["host"] == "down")
+
+def test_draining_host_is_never_chosen():
+    scheduler = make_scheduler({"small": room_for(2), "big": room_for(10)}, draining={"small"})
+    assert scheduler.place().name == "big"
+    assert {c["host"]: c["draining"] for c in scheduler.capacities()} == {"small": True, "big": False}
+
+def test_all_hosts_draining_raises():
+    scheduler = make_scheduler({"a": room_for(5), "b": room_for(5)}, draining={"a", "b"})
+    with pytest.raises(NoCapacityError):
+        scheduler.place()
+
+def test_exclude_skips_the_source_host():
+    scheduler = make_scheduler({"small": room_for(2), "big": room_for(10)})
+    assert scheduler.place(exclude={"small"}).name == "big"
+    with pytest.raises(NoCapacityError):
+        scheduler.place(exclude={"small", "big"})
+
+def test_from_env_parses_hosts_and_rejects_bad_entries():
+    scheduler = DockerScheduler.from_env("n1=tcp://10.0.0.1:2375|10.0.0.1,n2=tcp://10.0.0.2:2375|10.0.0.2")
+    assert list(scheduler.hosts) == ["n1", "n2"]
+    assert scheduler.get_host("n2").public_url(3000) == "http://10.0.0.2:3000"
+    with pytest.raises(ValueError):
+        DockerScheduler.from_env("n1=tcp://10.0.0.1:2375")
@@ -0,0 +1,30 @@
+# tests/test_idle_manager.py
+import asyncio
+from types import SimpleNamespace
+
+from services import idle_manager as idle_module
+from services.idle_manager import IdleManager
+
+def test_sends_dropped_after_failed_wake_are_archived_as_failed(monkeypatch):
+    recorded = []
+    monkeypatch.setattr(idle_module.message_archiver, "record", lambda *args, **kwargs: recorded.append((args, kwargs)))
+    manager = IdleManager()
+    def fail_wake(instance_name):
+        raise TimeoutError("la sesión no arrancó")
+    monkeypatch.setattr(manager, "_wake", fail_wake)
+
+    async def scenario():
+        instance = SimpleNamespace(id=7, instance_name="wa_instance_1")
+        async def never_called(awake_instance):
+            raise AssertionError("no debería enviarse")
+        assert manager.queue_send(instance, never_called, "34600000001", "hola", "ghl-1")
+        assert manager.queue_send(instance, never_called, "34600000002", "adiós")
+        await manager._waking["wa_instance_1"]
+
+    asyncio.run(scenario())
+    assert [args for args, _ in recorded] == [(7, "34600000001", "outbound", "failed"), (7, "34600000002", "outbound", "failed")]
+    assert [kwargs for _, kwargs in recorded] == [
+        {"body": "hola", "source": "ghl", "ghl_message_id": "ghl-1"},
+        {"body": "adiós", "source": "ghl", "ghl_message_id": None},
+    ]
+    assert not manager._queues and not manager._waking